@@ -1,15 +1,177 @@
 import os
+import sys
+import json
+import logging
 import argparse
-from sonne.generator import generate_site
+from datetime import datetime
 from sonne.setup import setup
+from sonne.stamp import up_to_date
+from sonne.stats import BuildStats
+
+logger = logging.getLogger(__name__)
+
+CLIENT_REQUESTS = ('build', 'refresh', 'status', 'stop')
 
 def main():
     parser = argparse.ArgumentParser(description="Run Sonne static site generator")
+    parser.add_argument('command', nargs='?', default='build', choices=('build', 'refresh', 'serve', 'client', 'merge'),
+                        help='build the site (the default), refresh variables, serve (a daemon that rebuilds on changes), '
+                             'client (send a request to the daemon) or merge (combine --shard builds)')
+    parser.add_argument('request', nargs='?', choices=CLIENT_REQUESTS,
+                        help='For client: what to ask the daemon for (default: build)')
     parser.add_argument('--path', type=str, default=os.getcwd(), help='Path to the site directory')
+    parser.add_argument('--force', action='store_true', help='Rebuild every output, ignoring the build manifest')
+    parser.add_argument('--shard', type=shard_argument, default=None, metavar='I/N',
+                        help='Build only the I-th of N parts of the site, for sonne merge to combine')
+    parser.add_argument('--jobs', type=int, default=None, help='Number of worker processes for blog rendering (default: number of cores)')
+    parser.add_argument('--refresh-variables', action='store_true',
+                        help='Re-run the source scripts and re-render only outputs that use variables that changed')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Also log every file written and every block run')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only log warnings and errors')
+    parser.add_argument('--profile', nargs='?', const='sonne.prof', default=None, metavar='PATH',
+                        help='Write a cProfile dump of the build (default: sonne.prof; relative paths are '
+                             'in the cache directory)')
+    parser.add_argument('--report', type=str, default=None, metavar='PATH',
+                        help='Write stage timings and the slowest files, scripts, blocks and images as JSON '
+                             '(relative paths are in the cache directory)')
+    parser.add_argument('--socket', type=str, default=None, metavar='PATH',
+                        help='Unix socket of the daemon (default: serve.sock in the cache directory)')
+    parser.add_argument('--poll', type=float, default=None, metavar='SECONDS',
+                        help='For serve: check for changes every SECONDS instead of using inotify')
     args = parser.parse_args()
+    if args.request and args.command != 'client':
+        parser.error(f"{args.request} only makes sense after client")
+    if args.refresh_variables:
+        args.command = 'refresh'
+    if args.shard and args.command != 'build':
+        parser.error("--shard only works with build")
+
+    configure_logging(args.verbose, args.quiet)
+
+    if args.command == 'serve':
+        from sonne.serve import serve
+        setup(args.path)
+        serve(args.path, args.socket, args.jobs, args.poll is not None, args.poll or 1.0)
+        return
+    # The one pass over sonne.config; run(), run_client() and cache_file() all use it
+    args.config = setup(args.path)
+    if args.command == 'client':
+        sys.exit(run_client(args))
+
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        stats = run(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            path = cache_file(args, args.profile)
+            profiler.dump_stats(path)
+            logger.info(f"Wrote profile to {path}")
+
+    if args.report:
+        write_report(args.report, stats.to_dict(slowest=20), args)
+
+def run(args):
+    # args.config comes from the setup checker in main()
+    config = args.config
+
+    if args.command == 'build' and not args.force and args.shard is None and up_to_date(args.path, config):
+        # Cron jobs and hooks run this a lot; a stat of every input is all it takes to tell nothing changed
+        logger.info("Nothing changed since the last build.")
+        stats = BuildStats()
+        stats.finish()
+        return stats
 
-    # Run setup checker and daemon
-    setup(args.path)
+    # Loaded only now, as the build needs them
+    from sonne.generator import generate_site, refresh_site, merge_site
+    if args.command == 'refresh':
+        return refresh_site(args.path, config=config)
+    if args.command == 'merge':
+        from sonne.shards import MergeError
+        try:
+            return merge_site(args.path, force=args.force, jobs=args.jobs, config=config)
+        except MergeError as e:
+            logger.error(f"Cannot merge: {e}")
+            sys.exit(1)
 
     # Assuming generate_site expects a path to the site directory
-    generate_site(args.path)
+    return generate_site(args.path, force=args.force, jobs=args.jobs, shard=args.shard, config=config)
+
+def shard_argument(text):
+    from sonne.shards import parse_shard
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def configure_logging(verbose=False, quiet=False):
+    level = logging.DEBUG if verbose else logging.WARNING if quiet else logging.INFO
+    handler = logging.StreamHandler()
+    handler.setFormatter(LevelFormatter())
+    logging.basicConfig(level=level, handlers=[handler])
+
+class LevelFormatter(logging.Formatter):
+    """Plain messages, with the level in front of warnings and errors."""
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            return f"{record.levelname}: {message}"
+        return message
+
+def run_client(args):
+    """Hand the request to a running `sonne serve`, building here instead when none is running."""
+    from sonne.serve import send, socket_path
+    request = args.request or 'build'
+    args.command = request
+    path = args.socket or socket_path(args.path, args.config)
+    response = send(path, {'command': request, 'force': args.force})
+    if response is None:
+        if request in ('status', 'stop'):
+            logger.warning(f"No sonne daemon is listening on {path}")
+            return 1
+        logger.warning(f"No sonne daemon is listening on {path}, building here instead")
+        stats = run(args)
+        if args.report:
+            write_report(args.report, stats.to_dict(slowest=20), args)
+        return 0
+
+    # Replay what the daemon logged for this request
+    for level, message in response.get('log', []):
+        logger.log(level, message)
+    if not response['ok']:
+        logger.error(response['error'])
+        return 1
+    if request == 'status':
+        logger.info(f"Serving {response['site']} (pid {response['pid']}, watching with {response['watching']}), "
+                    f"{response['builds']} builds, last at {response['last_build']}")
+    if args.report and 'stats' in response:
+        write_report(args.report, response['stats'], args)
+    return 0
+
+def cache_file(args, path):
+    # In the site directory (the working directory, by default) the file would be copied to the output
+    # and count as a changed input, so relative paths go to the cache directory
+    if os.path.isabs(path):
+        return path
+    directory = os.path.join(args.path, args.config.get_setting('DEFAULT', 'CacheDirectory'))
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, path)
+
+def write_report(path, stats, args):
+    # stats as given by BuildStats.to_dict()
+    path = cache_file(args, path)
+    report = {
+        'built': datetime.now().isoformat(timespec='seconds'),
+        'site': os.path.abspath(args.path),
+        'mode': args.command if args.command in ('refresh', 'merge') else 'force' if args.force else 'build',
+        **stats,
+    }
+    with open(path, 'w') as file:
+        json.dump(report, file, indent=2)
+    logger.info(f"Wrote build report to {path}")
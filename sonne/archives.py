@@ -0,0 +1,169 @@
+# archives.py
+
+import os
+import re
+import html
+import time
+import logging
+from datetime import datetime
+from sonne.manifest import hash_value
+from sonne.templates import render_template
+from sonne.postprocess import write_text_output
+
+logger = logging.getLogger(__name__)
+
+# Where each kind of archive lives inside the blog output directory
+ARCHIVE_DIRECTORIES = {'index': '', 'tag': 'tags', 'category': 'categories', 'month': 'archive'}
+
+def slugify(text):
+    # Letters and digits of any script are kept; a name with none is spelled out in hex
+    text = str(text)
+    return re.sub(r'[\W_]+', '-', text.lower()).strip('-') or text.encode('utf-8').hex() or 'untitled'
+
+def build_indexes(posts):
+    """Posts grouped by tag, category and year-month, newest first, in a single pass.
+
+    Returns {kind: {key: [post, ...]}} for the kinds 'tag', 'category' and
+    'month' (keys like '2024-01'), plus 'index' with every post under ''.
+    posts are all_blog_posts entries, sorted oldest first.
+    """
+    indexes = {'index': {'': []}, 'tag': {}, 'category': {}, 'month': {}}
+    for post in reversed(posts):
+        indexes['index'][''].append(post)
+        for tag in post.get('tags') or []:
+            indexes['tag'].setdefault(tag, []).append(post)
+        if post.get('category'):
+            indexes['category'].setdefault(post['category'], []).append(post)
+        if re.match(r'\d{4}-(0[1-9]|1[0-2])', post.get('date_posted', '')):
+            indexes['month'].setdefault(post['date_posted'][:7], []).append(post)
+    return indexes
+
+def archive_summary(indexes, page_size):
+    """What the blog_archives variable holds: every archive's URL, post count and page count, by kind."""
+    directories = archive_directories(indexes)
+    return {kind: {key: {'url': archive_url(directories[kind][key]), 'posts': len(posts),
+                         'pages': page_count(len(posts), page_size)}
+                   for key, posts in archives.items()}
+            for kind, archives in indexes.items()}
+
+def archive_url(directory, page=1):
+    # Relative to the site root, like the full_url of a post
+    return '/'.join(filter(None, ['blog', directory, page_filename(page)]))
+
+def archive_directories(indexes):
+    """{kind: {key: directory}} of every archive, relative to the blog output directory.
+
+    Tags and categories that slugify alike ('C', 'C++' and 'c#' all give
+    'c') would overwrite each other's pages. The one spelled like the slug,
+    or else the first in sorted order, keeps it; the others get a short hash
+    of their name appended.
+    """
+    directories = {}
+    for kind, archives in indexes.items():
+        if kind in ('index', 'month'):
+            directories[kind] = {key: archive_directory(kind, key) for key in archives}
+            continue
+        by_slug = {}
+        for key in sorted(archives, key=str):
+            by_slug.setdefault(slugify(key), []).append(key)
+        slugs = {}
+        for slug, keys in by_slug.items():
+            keeper = next((key for key in keys if str(key).lower() == slug), keys[0])
+            for key in keys:
+                slugs[key] = slug if key == keeper else f"{slug}-{hash_value(str(key))[:8]}"
+        directories[kind] = {key: archive_directory(kind, slugs[key]) for key in archives}
+    return directories
+
+def archive_directory(kind, slug):
+    if kind == 'index':
+        return ''
+    if kind == 'month':
+        return '/'.join([ARCHIVE_DIRECTORIES[kind]] + slug.split('-'))
+    return f"{ARCHIVE_DIRECTORIES[kind]}/{slug}"
+
+def page_filename(page):
+    return 'index.html' if page == 1 else f'page{page}.html'
+
+def page_count(post_count, page_size):
+    return max(1, -(-post_count // page_size))
+
+def archive_title(kind, key):
+    if kind == 'tag':
+        return f"Posts tagged {key}"
+    if kind == 'category':
+        return f"Posts in {key}"
+    if kind == 'month':
+        return f"Posts from {datetime.strptime(key, '%Y-%m'):%B %Y}"
+    return "All posts"
+
+def render_archives(indexes, blog_dir, output_dir, config, manifest, store, templates, stats=None):
+    """Write every page of every archive through the archive template, skipping pages whose slice is unchanged."""
+    template_path = os.path.join(blog_dir, config.get_setting('DEFAULT', 'ArchiveBase'))
+    page_size = max(1, int(config.get_setting('DEFAULT', 'ArchivePageSize')))
+    minify_output = config.get_setting('DEFAULT', 'MinifyOutput')
+    template_hash = manifest.file_hash(template_path)
+    template = templates.get(template_path, template_hash)
+    variable_hashes = store.hashes()
+
+    directories = archive_directories(indexes)
+    rendered = skipped = 0
+    for kind, archives in indexes.items():
+        for key, posts in archives.items():
+            directory = directories[kind][key]
+            for page, mond_variables in archive_pages(kind, key, directory, posts, page_size):
+                output_path = os.path.join(output_dir, *archive_url(directory, page).split('/'))
+                inputs = {'template': template_hash, 'archive': hash_value(mond_variables)}
+                if manifest.is_fresh(output_path, inputs, variable_hashes):
+                    skipped += 1
+                    continue
+                start = time.perf_counter()
+                used = set()
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                write_text_output(output_path, render_template(template, store, mond_variables, used), minify_output)
+                manifest.record(output_path, inputs, used, variable_hashes, {'kind': 'archive'})
+                rendered += 1
+                if stats is not None:
+                    stats.record('file', os.path.relpath(output_path, output_dir), time.perf_counter() - start)
+    logger.info(f"Rendered {rendered} archive pages, skipped {skipped} unchanged ones.")
+
+def archive_pages(kind, key, directory, posts, page_size):
+    """(page number, Mond variables) of each page of one archive."""
+    pages = page_count(len(posts), page_size)
+    for page in range(1, pages + 1):
+        page_posts = posts[(page - 1) * page_size:page * page_size]
+        here = '/'.join(filter(None, ['blog', directory]))
+        yield page, {
+            'archive_kind': kind,
+            'archive_key': key,
+            'archive_title': archive_title(kind, key),
+            'page': page,
+            'page_count': pages,
+            'post_count': len(posts),
+            'prev_page': page_filename(page - 1) if page > 1 else '',
+            'next_page': page_filename(page + 1) if page < pages else '',
+            'post_list': post_list_html(page_posts, here),
+            'pagination': pagination_html(page, pages),
+            'current_year': datetime.now().year,
+        }
+
+def post_list_html(posts, here):
+    # Links are relative to the archive page, so the site works from any base path
+    items = []
+    for post in posts:
+        url = os.path.relpath(post['full_url'], here).replace(os.sep, '/')
+        description = f"<p>{html.escape(post['description'])}</p>" if post.get('description') else ''
+        items.append(f'<li><a href="{html.escape(url)}">{html.escape(post["title"])}</a> '
+                     f'<time datetime="{post["date_posted"]}">{post["date_posted"]}</time>{description}</li>')
+    return '<ul class="archive-posts">\n' + '\n'.join(items) + '\n</ul>'
+
+def pagination_html(page, pages):
+    if pages == 1:
+        return ''
+    links = []
+    if page > 1:
+        links.append(f'<a href="{page_filename(page - 1)}" rel="prev">Newer</a>')
+    for number in range(1, pages + 1):
+        links.append(f'<span>{number}</span>' if number == page else f'<a href="{page_filename(number)}">{number}</a>')
+    if page < pages:
+        links.append(f'<a href="{page_filename(page + 1)}" rel="next">Older</a>')
+    return '<nav class="pagination">' + ' '.join(links) + '</nav>'
@@ -0,0 +1,164 @@
+# assets.py
+
+import os
+import mmap
+import shutil
+import filecmp
+from sonne.variable_manager import TOKEN_PATTERN
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows; reflinks are skipped there
+    fcntl = None
+
+# ioctl request for a copy-on-write clone of a whole file (Linux FICLONE)
+FICLONE = 0x40049409
+
+# Byte sequences that start a Sonne placeholder; {-}{...} is only filled in blog templates
+MARKERS = (b'{+}{', b'{p}{#')
+# Where a chunk may not be cut; {-}{...} counts since it can swallow a marker
+MARKER_START = ('{+}{', '{p}{#', '{-}{')
+
+# Files above this size are substituted chunk by chunk instead of read whole
+STREAM_THRESHOLD = 8 << 20
+CHUNK_SIZE = 1 << 20
+
+def has_markers(path):
+    """Whether a file contains any Sonne placeholder, without reading it into memory."""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return any(mapped.find(marker) != -1 for marker in MARKERS)
+
+def copy_file(input_path, output_path):
+    """Copy a file in the kernel (copy_file_range, then sendfile), swapping it in atomically."""
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(input_path, 'rb') as source, open(temp_path, 'wb') as target:
+        size = os.fstat(source.fileno()).st_size
+        if not _copy_in_kernel(source.fileno(), target.fileno(), size):
+            source.seek(0)
+            target.seek(0)
+            target.truncate()
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+    shutil.copystat(input_path, temp_path)
+    os.replace(temp_path, output_path)
+
+def _copy_in_kernel(source_fd, target_fd, size):
+    for name in ('copy_file_range', 'sendfile'):
+        copy = getattr(os, name, None)
+        if copy is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                if name == 'copy_file_range':
+                    copied = copy(source_fd, target_fd, size - offset, offset, offset)
+                else:
+                    copied = copy(target_fd, source_fd, offset, size - offset)
+                if copied == 0:
+                    break
+                offset += copied
+        except OSError:
+            pass  # e.g. across filesystems on older kernels; try the next way
+        if offset >= size:
+            return True
+        os.ftruncate(target_fd, 0)
+        os.lseek(target_fd, 0, os.SEEK_SET)
+    return False
+
+def link_file(input_path, output_path):
+    """Place input_path at output_path without copying bytes when the filesystem allows it.
+
+    Tries a hardlink, then a reflink (copy-on-write clone), then falls back to a copy.
+    An output that already holds the same bytes is left alone, and a changed one is
+    swapped in atomically.
+    """
+    if os.path.exists(output_path):
+        if os.path.samefile(input_path, output_path) or filecmp.cmp(input_path, output_path, shallow=False):
+            return
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)  # Left over from an interrupted build; may be a link into the cache
+    try:
+        os.link(input_path, temp_path)
+    except OSError:
+        if fcntl is None:
+            copy_file(input_path, output_path)
+            return
+        try:
+            with open(input_path, 'rb') as source, open(temp_path, 'wb') as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            shutil.copystat(input_path, temp_path)
+        except OSError:
+            os.remove(temp_path)
+            copy_file(input_path, output_path)
+            return
+    os.replace(temp_path, output_path)
+
+def copy_asset(input_path, output_path, link=True):
+    """Pass a file through to the output unchanged; returns False when the output was already up to date.
+
+    Copies keep the source's mtime, so an output with the source's size and
+    mtime (or a hardlink to it) is taken to be current.
+    """
+    if os.path.exists(output_path):
+        source_stat, output_stat = os.stat(input_path), os.stat(output_path)
+        if os.path.samestat(source_stat, output_stat) or (
+                source_stat.st_size == output_stat.st_size and source_stat.st_mtime_ns == output_stat.st_mtime_ns):
+            return False
+    if link:
+        link_file(input_path, output_path)
+    else:
+        copy_file(input_path, output_path)
+    return True
+
+def stream_substitute(input_path, output_path, store, used=None):
+    """Substitute placeholders in a large file chunk by chunk; returns False if the output did not change.
+
+    Chunks are cut right before a placeholder that is not complete yet, so every
+    placeholder reaches the store whole and the result matches a whole-file pass.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(input_path, 'r') as source, open(temp_path, 'w') as target:
+        carry = ''
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            text = carry + chunk
+            cut = len(text) if not chunk else complete_prefix(text)
+            target.write(store.substitute(text[:cut], used=used))
+            carry = text[cut:]
+            if not chunk:
+                break
+
+    if os.path.exists(output_path) and filecmp.cmp(temp_path, output_path, shallow=False):
+        os.remove(temp_path)
+        return False
+    os.replace(temp_path, output_path)
+    return True
+
+def complete_prefix(text):
+    # Length of the longest prefix of text that does not end inside a placeholder
+    position = 0
+    # Next occurrence of each marker, searched for again only once position moves past it
+    upcoming = {marker: -1 for marker in MARKER_START}
+    while True:
+        for marker, index in upcoming.items():
+            if index != len(text) and index < position:
+                found = text.find(marker, position)
+                upcoming[marker] = len(text) if found == -1 else found
+        start = min(upcoming.values())
+        if start == len(text):
+            break
+        match = TOKEN_PATTERN.match(text, start)
+        if match:
+            position = match.end()
+        elif not text.startswith('{p}{#', start) and '\n' in text[start:]:
+            position = start + 1  # Variable and Mond placeholders never span lines, so this one never completes
+        else:
+            return start
+    # The chunk may end partway through a marker
+    for length in range(min(len(max(MARKER_START, key=len)) - 1, len(text) - position), 0, -1):
+        if any(marker.startswith(text[-length:]) for marker in MARKER_START):
+            return len(text) - length
+    return len(text)
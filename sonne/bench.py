@@ -0,0 +1,294 @@
+# bench.py
+#
+# Build benchmarks on synthetic sites:
+#
+#   python -m sonne.bench --posts 500 --pages 100 --images 40 --output bench.json
+#   python -m sonne.bench --posts 500 --pages 100 --images 40 --baseline bench.json --threshold 0.15
+#
+# Every build runs in a fresh child process so its peak RSS can be measured on its own.
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import date, timedelta
+from sonne.config import DEFAULT_SETTINGS
+
+# cold: empty output and caches; noop: nothing changed; edit: one post changed;
+# posts: the markdown front-end alone (front matter, image rewrite, conversion) over every post
+SCENARIOS = ('cold', 'noop', 'edit', 'posts')
+
+# Differences below these are noise, not regressions
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_KIB = 1024
+
+WORDS = ('sun', 'solar', 'panel', 'battery', 'charge', 'static', 'site', 'server', 'watt', 'light',
+         'energy', 'low', 'tech', 'web', 'page', 'dither', 'image', 'weather', 'cloud', 'power')
+TAGS = ('solar', 'hardware', 'software', 'weather', 'notes', 'travel')
+
+def make_site(site_dir, posts=100, pages=20, images=10, variables=50, blocks=10, seed=0):
+    """Write a synthetic Sonne site with the given numbers of posts, pages, images, variables and distinct {p} blocks."""
+    rng = random.Random(seed)
+    variables = max(1, variables)
+    blog_dir = os.path.join(site_dir, DEFAULT_SETTINGS['BlogDirectory'])
+    pages_dir = os.path.join(site_dir, DEFAULT_SETTINGS['PagesDirectory'])
+    source_dir = os.path.join(site_dir, DEFAULT_SETTINGS['SourceDirectory'])
+    for directory in (os.path.join(blog_dir, 'imgs'), pages_dir, source_dir):
+        os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(site_dir, 'sonne.config'), 'w') as file:
+        json.dump({'DEFAULT': dict(DEFAULT_SETTINGS)}, file, indent=4)
+
+    with open(os.path.join(source_dir, 'synthetic.py'), 'w') as file:
+        file.write(f"for i in range({variables}):\n    sonne_var(f'var_{{i}}', i * 7)\n")
+
+    block_codes = [f"result = data['var_{i % variables}']['data'] * {i + 1}" for i in range(blocks)]
+
+    with open(os.path.join(blog_dir, DEFAULT_SETTINGS['BlogBase']), 'w') as file:
+        file.write("<html><head><title>{-}{title}</title></head>\n<body><h1>{-}{title}</h1>\n"
+                   "<p>{-}{description} (battery at {+}{var_0}%)</p>\n{-}{content}\n<nav>{-}{navigation}</nav>\n"
+                   "<footer>{p}{#\nresult = len(data['all_blog_posts']['data'])\n#} posts</footer></body></html>\n")
+
+    if images:
+        from PIL import Image  # Only needed when the site has images
+        for i in range(images):
+            extent = (-2.0 + i * 0.05, -1.0, 0.5 + i * 0.05, 1.0)
+            Image.effect_mandelbrot((1200, 800), extent, 64).convert('RGB').save(
+                os.path.join(blog_dir, 'imgs', f'image_{i}.jpg'), quality=90)
+
+    first_day = date(2020, 1, 1)
+    for i in range(posts):
+        paragraphs = [' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) for _ in range(rng.randint(3, 12))]
+        paragraphs.insert(1, f"Today's reading is {{+}}{{var_{i % variables}}}.")
+        if images:
+            paragraphs.insert(2, f'![figure {i}](imgs/image_{i % images}.jpg "Figure {i}")')
+        with open(os.path.join(blog_dir, f'post_{i}.md'), 'w') as file:
+            file.write(f"---\ntitle: Post number {i}\ndate_posted: {first_day + timedelta(days=i)}\n"
+                       f"page_url: post-{i}\ndescription: Synthetic post {i}\nauthor: Bench\n"
+                       f"tags: {' '.join(rng.sample(TAGS, 2))}\n---\n# Post {i}\n\n" + '\n\n'.join(paragraphs) + '\n')
+
+    for i in range(pages):
+        body = [f"<p>{' '.join(rng.choice(WORDS) for _ in range(60))}</p>" for _ in range(5)]
+        body += [f"<p>{{+}}{{var_{(i + k) % variables}}}</p>" for k in range(3)]
+        body += [f"<p>{{p}}{{#\n{code}\n#}}</p>" for code in rng.sample(block_codes, min(3, len(block_codes)))]
+        with open(os.path.join(pages_dir, f'page_{i}.html'), 'w') as file:
+            file.write("<html><body>\n" + '\n'.join(body) + "\n</body></html>\n")
+
+    with open(os.path.join(site_dir, DEFAULT_SETTINGS['IndexPage']), 'w') as file:
+        file.write("<html><body><h1>Synthetic site</h1>\n<p>{p}{#\n"
+                   "result = ', '.join(post['title'] for post in data['all_blog_posts']['data'][-10:])\n#}</p>\n</body></html>\n")
+
+def run_build(site_dir, jobs=None, force=False, posts_only=False):
+    """Build the site in a child process; returns its stats plus peak RSS (KiB) of the build and its workers.
+
+    With posts_only the child only runs every post through the markdown front-end, see child_posts.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result_path = os.path.join(temp_dir, 'result.json')
+        command = [sys.executable, '-m', 'sonne.bench', '--child', site_dir, result_path]
+        if jobs:
+            command += ['--jobs', str(jobs)]
+        if force:
+            command.append('--force')
+        if posts_only:
+            command.append('--posts-only')
+        env = dict(os.environ)
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+        subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, 'r') as file:
+            return json.load(file)
+
+def child_build(site_dir, result_path, jobs=None, force=False):
+    import resource
+    from sonne.generator import generate_site
+
+    stats = generate_site(site_dir, force=force, jobs=jobs)
+    result = stats.to_dict()
+    result['peak_rss_kib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['peak_worker_rss_kib'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    with open(result_path, 'w') as file:
+        json.dump(result, file)
+
+def child_posts(site_dir, result_path):
+    # Times markdown_to_html on every post, after one untimed pass that fills the image cache and warms up
+    import time
+    import resource
+    from sonne.config import Config
+    from sonne.blog import markdown_to_html
+    from sonne.images import ImagePipeline, image_settings
+
+    config = Config(os.path.join(site_dir, 'sonne.config'))
+    blog_dir = os.path.join(site_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
+    output_dir = os.path.join(site_dir, config.get_setting('DEFAULT', 'OutputDirectory'))
+    images = ImagePipeline(os.path.join(site_dir, config.get_setting('DEFAULT', 'CacheDirectory')), image_settings(config))
+    paths = sorted(os.path.join(blog_dir, name) for name in os.listdir(blog_dir) if name.endswith('.md'))
+    for path in paths:
+        markdown_to_html(path, site_dir, output_dir, images, [])
+
+    seconds = []
+    for path in paths:
+        start = time.perf_counter()
+        markdown_to_html(path, site_dir, output_dir, images, [])
+        seconds.append(time.perf_counter() - start)
+    result = {'total': sum(seconds), 'stages': {'posts': sum(seconds)}, 'files_written': 0,
+              'per_post': statistics.median(seconds) if seconds else 0.0,
+              'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              'peak_worker_rss_kib': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+    with open(result_path, 'w') as file:
+        json.dump(result, file)
+
+def clean_site(site_dir):
+    # Back to a cold start: no outputs, caches, manifests or variables from earlier builds
+    for name in (DEFAULT_SETTINGS['OutputDirectory'], DEFAULT_SETTINGS['CacheDirectory']):
+        shutil.rmtree(os.path.join(site_dir, name), ignore_errors=True)
+    variables_path = os.path.join(site_dir, DEFAULT_SETTINGS['VariablesFile'])
+    if os.path.exists(variables_path):
+        os.remove(variables_path)
+
+def edit_post(site_dir, run):
+    with open(os.path.join(site_dir, DEFAULT_SETTINGS['BlogDirectory'], 'post_0.md'), 'a') as file:
+        file.write(f"\nEdited in run {run}.\n")
+
+def run_scenarios(site_dir, runs=3, jobs=None, scenarios=SCENARIOS):
+    """Median stats of every scenario over `runs` builds."""
+    results = {}
+    for scenario in scenarios:
+        samples = []
+        for run in range(runs):
+            if scenario == 'posts':
+                samples.append(run_build(site_dir, posts_only=True))
+                continue
+            if scenario == 'cold':
+                clean_site(site_dir)
+            else:
+                if not os.path.exists(os.path.join(site_dir, DEFAULT_SETTINGS['OutputDirectory'])):
+                    run_build(site_dir, jobs)  # Warm up first
+                if scenario == 'edit':
+                    edit_post(site_dir, run)
+            samples.append(run_build(site_dir, jobs))
+        results[scenario] = summarize(samples)
+    return results
+
+def summarize(samples):
+    stage_names = list(dict.fromkeys(name for sample in samples for name in sample['stages']))
+    return {
+        'runs': len(samples),
+        'total': statistics.median(sample['total'] for sample in samples),
+        'stages': {name: statistics.median(sample['stages'].get(name, 0.0) for sample in samples)
+                   for name in stage_names},
+        'files_written': statistics.median(sample['files_written'] for sample in samples),
+        'peak_rss_kib': max(sample['peak_rss_kib'] for sample in samples),
+        'peak_worker_rss_kib': max(sample['peak_worker_rss_kib'] for sample in samples),
+        **({'per_post': statistics.median(sample['per_post'] for sample in samples)} if 'per_post' in samples[0] else {}),
+    }
+
+def find_regressions(results, baseline, threshold):
+    """(scenario, metric, baseline value, new value) of every metric that got more than threshold worse."""
+    regressions = []
+    for scenario, result in results.items():
+        old = baseline.get('results', {}).get(scenario)
+        if old is None:
+            continue
+        timings = [('total', old['total'], result['total'])]
+        timings += [(f"stage:{name}", old['stages'][name], seconds)
+                    for name, seconds in result['stages'].items() if name in old['stages']]
+        for metric, old_value, new_value in timings:
+            if new_value > old_value * (1 + threshold) and new_value - old_value > MIN_REGRESSION_SECONDS:
+                regressions.append((scenario, metric, old_value, new_value))
+        for metric in ('peak_rss_kib', 'peak_worker_rss_kib'):
+            if (old.get(metric) and result[metric] > old[metric] * (1 + threshold)
+                    and result[metric] - old[metric] > MIN_REGRESSION_KIB):
+                regressions.append((scenario, metric, old[metric], result[metric]))
+    return regressions
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    for scenario, result in results.items():
+        print(f"{scenario:5}  {result['total']:8.3f}s  {int(result['files_written']):6} files written  "
+              f"peak RSS {result['peak_rss_kib'] / 1024:.0f} MiB (workers {result['peak_worker_rss_kib'] / 1024:.0f} MiB)")
+        for name, seconds in result['stages'].items():
+            print(f"\t{name:12} {seconds:8.3f}s")
+        if 'per_post' in result:
+            print(f"\t{'per post':12} {result['per_post'] * 1000:8.3f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Sonne builds on a synthetic site")
+    parser.add_argument('--posts', type=int, default=100)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--variables', type=int, default=50)
+    parser.add_argument('--blocks', type=int, default=10, help='Number of distinct embedded Python blocks')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=3, help='Builds per scenario; the median is reported')
+    parser.add_argument('--jobs', type=int, default=None)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--site', type=str, default=None, help='Generate the site here and keep it (default: a temporary directory)')
+    parser.add_argument('--output', type=str, default=None, help='Write the results to this JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='Results JSON of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown against the baseline (0.2 = 20%%)')
+    parser.add_argument('--child', nargs=2, metavar=('SITE', 'RESULT'), help=argparse.SUPPRESS)
+    parser.add_argument('--force', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--posts-only', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        if args.posts_only:
+            child_posts(args.child[0], args.child[1])
+        else:
+            child_build(args.child[0], args.child[1], args.jobs, args.force)
+        return
+
+    params = {name: getattr(args, name) for name in ('posts', 'pages', 'images', 'variables', 'blocks', 'seed', 'runs', 'jobs')}
+    site_dir = args.site or tempfile.mkdtemp(prefix='sonne-bench-')
+    try:
+        if os.path.exists(os.path.join(site_dir, 'sonne.config')):
+            print(f"Using the existing site in {site_dir}")
+        else:
+            print(f"Generating a synthetic site in {site_dir}")
+            make_site(site_dir, args.posts, args.pages, args.images, args.variables, args.blocks, args.seed)
+        results = run_scenarios(site_dir, args.runs, args.jobs, args.scenarios)
+    finally:
+        if args.site is None:
+            shutil.rmtree(site_dir, ignore_errors=True)
+
+    print_results(results)
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'params': params,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=4)
+        print(f"Wrote results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline.get('params') != params:
+            print("Warning: the baseline was run with different parameters")
+        regressions = find_regressions(results, baseline, args.threshold)
+        for scenario, metric, old_value, new_value in regressions:
+            print(f"REGRESSION {scenario} {metric}: {old_value:.3f} -> {new_value:.3f}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}")
+
+if __name__ == '__main__':
+    main()
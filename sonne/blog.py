@@ -1,47 +1,84 @@
 # blog.py
 
 import os
-import markdown
-from markdown.extensions.meta import MetaExtension
 import re
 import json
-from sonne.variable_manager import substitute_variables, report_variable
-from sonne.images import dither_image, copy_original_image
+from sonne.manifest import hash_value
+from sonne.parallel import run_parallel
+from sonne.images import ImagePipeline, image_settings
+from sonne.templates import TemplateCache, render_template
+from sonne.postprocess import write_text_output
+from sonne.stats import BuildStats
+from sonne.archives import build_indexes, archive_summary, render_archives
+from sonne.shards import in_shard
 import textwrap
+import time
+import logging
 from datetime import datetime
 
-def process_blogs(base_dir, output_dir, config):
+# Regex pattern to find image references in markdown
+# Pattern matches: ![alt text](image_path "title")
+IMAGE_PATTERN = re.compile(r'!\[(.*?)\]\((.*?)(?: "(.*?)")?\)')
+
+logger = logging.getLogger(__name__)
+
+def process_blogs(base_dir, output_dir, config, manifest, store, jobs=1, templates=None, stats=None, image_pipeline=None,
+                  shard=None):
+    """Convert the posts and publish them; a shard build (shard is (i, N)) converts its share and returns it instead."""
+    blog_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
+    cache_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'))
+    image_pipeline = image_pipeline if image_pipeline is not None else ImagePipeline(cache_dir, image_settings(config))
+    stats = stats if stats is not None else BuildStats()
+    blog_posts = []
+
+    post_paths = [os.path.join(root, file)
+                  for root, dirs, files in os.walk(blog_dir)
+                  for file in files if file.endswith('.md')
+                  and in_shard(os.path.relpath(os.path.join(root, file), base_dir), shard)]
+
+    # Collect metadata first, converting changed posts in parallel
+    loaded_posts = load_posts(post_paths, base_dir, output_dir, manifest, store.content, image_pipeline, jobs, stats)
+    for file_path, (content_hash, front_matter) in zip(post_paths, loaded_posts):
+        post_metadata = {
+            "title": front_matter.get("title", "No Title"),
+            "date_posted": front_matter.get("date_posted", ""),
+            "date_edited": front_matter.get("date_edited", ""),
+            "description": front_matter.get("description", ""),
+            "featured": front_matter.get("featured", False),
+            "author": front_matter.get("author", "Unattributed"),
+            "full_url": os.path.join("blog", front_matter.get("date_posted") + '-' + front_matter.get("page_url", "") + '.html'),
+            "url": os.path.join(front_matter.get("page_url", "")),
+            "page_url": front_matter.get("page_url", ""),
+            # The body itself lives in the content store, see ContentStore.read
+            "content_hash": content_hash,
+            "current_year": datetime.now().year,
+            "tags": front_matter_tags(front_matter.get("tags", "")),
+            "cover_img": front_matter.get("cover_img", ""),
+            "category": front_matter.get("category", ""),
+        }
+        blog_posts.append((post_metadata, front_matter, os.path.relpath(file_path, base_dir)))
+
+    if shard is not None:
+        # Linking and rendering posts needs all of them, so that is left to `sonne merge`
+        store.content.prune({post['content_hash'] for post, front_matter, rel_path in blog_posts})
+        if store.get('all_blog_posts') is None:
+            # Nothing merged yet; pages get this shard's posts for now and the merge renders them again
+            store.report('all_blog_posts', sorted((post for post, front_matter, rel_path in blog_posts),
+                                                  key=lambda post: (post['date_posted'], post['url'])))
+        return blog_posts
+    publish_posts(blog_posts, base_dir, output_dir, config, manifest, store, jobs, templates, stats)
+
+def publish_posts(blog_posts, base_dir, output_dir, config, manifest, store, jobs=1, templates=None, stats=None):
+    """Link, index and render converted posts, given as (metadata, front matter, markdown path), then the archives."""
     blog_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
     template_path = os.path.join(blog_dir, config.get_setting('DEFAULT', 'BlogBase'))
-    variables_path = os.path.join(base_dir, config.get_setting('DEFAULT', 'VariablesFile'))
     output_blog_dir = os.path.join(output_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
-    blog_posts_metadata = []
-
-    # Collect metadata first
-    for root, dirs, files in os.walk(blog_dir):
-        for file in files:
-            if file.endswith('.md'):
-                file_path = os.path.join(root, file)
-                html_content, mond_variables = markdown_to_html(file_path, base_dir, output_dir)
-                post_metadata = {
-                    "title": mond_variables.get("title", "No Title"),
-                    "date_posted": mond_variables.get("date_posted", ""),
-                    "date_edited": mond_variables.get("date_edited", ""),
-                    "description": mond_variables.get("description", ""),
-                    "featured": mond_variables.get("featured", False),
-                    "author": mond_variables.get("author", "Unattributed"),
-                    "full_url": os.path.join("blog", mond_variables.get("date_posted") + '-' + mond_variables.get("page_url", "") + '.html'),
-                    "url": os.path.join(mond_variables.get("page_url", "")),
-                    "page_url": mond_variables.get("page_url", ""),
-                    "content": html_content,
-                    "current_year": datetime.now().year,
-                    "tags": mond_variables.get("tags", "").split(),
-                    "cover_img": mond_variables.get("cover_img", ""),
-                }
-                blog_posts_metadata.append(post_metadata)
+    templates = templates if templates is not None else TemplateCache()
+    stats = stats if stats is not None else BuildStats()
 
     # Sort posts
-    blog_posts_metadata.sort(key=lambda x: (x['date_posted'], x['url']))
+    blog_posts.sort(key=lambda x: (x[0]['date_posted'], x[0]['url']))
+    blog_posts_metadata = [post for post, front_matter, rel_path in blog_posts]
 
     # Assign next and prev URLs
     for i, post in enumerate(blog_posts_metadata):
@@ -50,16 +87,158 @@ def process_blogs(base_dir, output_dir, config):
         blog_posts_metadata[i]['next_post'] = f"../{blog_posts_metadata[next_index]['full_url'][5:-5]}" if next_index is not None else None
         blog_posts_metadata[i]['prev_post'] = f"../{blog_posts_metadata[prev_index]['full_url'][5:-5]}" if prev_index is not None else None
 
-    # Save all blog posts metadata as a global variable
-    report_variable("all_blog_posts", blog_posts_metadata, variables_path)
+    # Save the post index as a global variable
+    store.report("all_blog_posts", blog_posts_metadata)
+    store.content.prune({post['content_hash'] for post in blog_posts_metadata})
+
+    # Group posts by tag, category and month once, for the archive pages and for pages listing them
+    archives = os.path.exists(os.path.join(blog_dir, config.get_setting('DEFAULT', 'ArchiveBase')))
+    if archives:
+        indexes = build_indexes(blog_posts_metadata)
+        store.report("blog_archives", archive_summary(indexes, config.get_setting('DEFAULT', 'ArchivePageSize')))
+    if not blog_posts_metadata:
+        return
+    variable_hashes = store.hashes()
+
+    # Work out which posts need rendering, skipping those whose inputs are unchanged
+    skipped = 0
+    pending = []
+    compiled_templates = {}
+    for post, front_matter, rel_path in blog_posts:
+        task = prepare_post(post, front_matter, rel_path, blog_dir, template_path, manifest, templates, compiled_templates)
+        if manifest.is_fresh(os.path.join(output_blog_dir, task[0]), task[3], variable_hashes):
+            skipped += 1
+            continue
+        pending.append(task)
 
-    # Now apply the template and write output
-    for post in blog_posts_metadata:
-        mond_variables.update(post)  # Include next/prev post URLs and any additional metadata
-        rendered_content = apply_template(post['content'], mond_variables, template_path, variables_path)
-        write_output(post['date_posted'] + '-' + post['page_url'] + '.html', rendered_content, os.path.join(output_blog_dir))
+    # Run the templates' embedded blocks once here so every render worker starts with their output
+    store.prefetch_blocks([value for template in compiled_templates.values() for kind, value in template if kind == 'python'])
 
-def markdown_to_html(file_path, base_dir, output_dir):
+    # Now apply the template and write output
+    rendered = run_parallel(render_post, [task[:3] for task in pending],
+                            jobs, init_render_worker, (store, compiled_templates, output_blog_dir,
+                                                      config.get_setting('DEFAULT', 'MinifyOutput')))
+    for (filename, post_template_path, mond_variables, inputs, rebuild), (used, seconds, block_timings) in zip(pending, rendered):
+        manifest.record(os.path.join(output_blog_dir, filename), inputs, used, variable_hashes, rebuild)
+        stats.record('file', os.path.relpath(os.path.join(output_blog_dir, filename), output_dir), seconds)
+        stats.merge('block', block_timings)
+
+    logger.info(f"Rendered {len(pending)} blog posts, skipped {skipped} unchanged ones.")
+
+    if archives:
+        render_archives(indexes, blog_dir, output_dir, config, manifest, store, templates, stats)
+
+def prepare_post(post, front_matter, rel_path, blog_dir, template_path, manifest, templates, compiled_templates):
+    """The render task of one post: (filename, template path, Mond variables, manifest inputs, rebuild info)."""
+    # Each post sees its own front matter plus next/prev post URLs and the other metadata
+    mond_variables = dict(front_matter, **post)
+    post_template_path = os.path.join(blog_dir, front_matter['template']) if 'template' in front_matter else template_path
+    template_hash = manifest.file_hash(post_template_path)
+    compiled_templates[post_template_path] = templates.get(post_template_path, template_hash)
+    filename = post['date_posted'] + '-' + post['page_url'] + '.html'
+    inputs = {'template': template_hash, 'post': hash_value(mond_variables)}
+    rebuild = {'kind': 'post', 'markdown': rel_path, 'full_url': post['full_url']}
+    return filename, post_template_path, mond_variables, inputs, rebuild
+
+def refresh_posts(rebuilds, base_dir, output_dir, config, manifest, store, templates=None, stats=None):
+    """Re-render posts from the last build's parse, for when only the variables they read changed."""
+    blog_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
+    template_path = os.path.join(blog_dir, config.get_setting('DEFAULT', 'BlogBase'))
+    output_blog_dir = os.path.join(output_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
+    templates = templates if templates is not None else TemplateCache()
+    posts_by_url = {post['full_url']: post for post in store.get('all_blog_posts') or []}
+
+    compiled_templates = {}
+    for rebuild in rebuilds:
+        cached = manifest.posts.get(rebuild['markdown'])
+        post = posts_by_url.get(rebuild['full_url'])
+        if cached is None or post is None:
+            logger.warning(f"Cannot refresh {rebuild['full_url']} without a full build.")
+            continue
+        filename, post_template_path, mond_variables, inputs, rebuild = prepare_post(
+            post, cached['mond_variables'], rebuild['markdown'], blog_dir, template_path, manifest, templates, compiled_templates)
+        init_render_worker(store, compiled_templates, output_blog_dir, config.get_setting('DEFAULT', 'MinifyOutput'))
+        used, seconds, block_timings = render_post(filename, post_template_path, mond_variables)
+        if stats is not None:
+            stats.record('file', os.path.relpath(os.path.join(output_blog_dir, filename), output_dir), seconds)
+            stats.merge('block', block_timings)
+        manifest.record(os.path.join(output_blog_dir, filename), inputs, used, store.hashes(), rebuild)
+
+def load_posts(post_paths, base_dir, output_dir, manifest, content, image_pipeline, jobs=1, stats=None):
+    # Reuse the last parse of each post when neither the markdown nor its images changed
+    stats = stats if stats is not None else BuildStats()
+    results = []
+    pending = []
+    for file_path in post_paths:
+        rel_path = os.path.relpath(file_path, base_dir)
+        markdown_hash = manifest.file_hash(file_path)
+        cached = manifest.get_post(rel_path)
+        if cached and cached['markdown_hash'] == markdown_hash:
+            image_sources = cached['image_sources']
+        else:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                text = file.read()
+            image_sources = [os.path.abspath(os.path.join(os.path.dirname(file_path), match.group(2)))
+                             for match in IMAGE_PATTERN.finditer(text)]
+        image_hashes = [manifest.file_hash(path) if os.path.exists(path) else None for path in image_sources]
+        image_pipeline.source_hashes.update(zip(image_sources, image_hashes))
+        key = hash_value([markdown_hash, image_pipeline.settings] + image_hashes)
+
+        if (cached and cached['key'] == key and content.has(cached['content_hash'])
+                and all(os.path.exists(path) for path in cached['images'])):
+            results.append((cached['content_hash'], dict(cached['mond_variables'])))
+            for path in cached['images']:
+                manifest.keep(path)
+        else:
+            results.append(None)
+            pending.append((len(results) - 1, rel_path, {'key': key, 'markdown_hash': markdown_hash,
+                                                         'image_sources': image_sources}))
+
+    # Images are encoded by the same workers, since the HTML needs the formats and sizes they pick
+    converted = run_parallel(convert_post, [(post_paths[index], base_dir, output_dir, content, image_pipeline)
+                                            for index, _, _ in pending], jobs)
+    encoded = 0
+    for (index, rel_path, entry), (content_hash, mond_variables, image_tasks, seconds, image_timings) in zip(pending, converted):
+        for output_path, input_path in image_tasks:
+            image_pipeline.add(output_path, input_path)
+            manifest.keep(output_path)
+        encoded += sum(count for _, count in image_timings.values())
+        stats.record('file', rel_path, seconds)
+        stats.merge('image', image_timings)
+        manifest.set_post(rel_path, dict(entry, images=[output_path for output_path, input_path in image_tasks],
+                                         content_hash=content_hash, mond_variables=mond_variables))
+        results[index] = (content_hash, dict(mond_variables))
+    with stats.stage('images'):
+        image_pipeline.finish(encoded)
+    return results
+
+def convert_post(file_path, base_dir, output_dir, content, images):
+    """(content hash, front matter, image placements, seconds taken, image encode timings) of one post."""
+    start = time.perf_counter()
+    image_tasks = []
+    html_content, mond_variables = markdown_to_html(file_path, base_dir, output_dir, images, image_tasks)
+    # Bodies go straight to the content store instead of travelling back to the parent
+    content_hash = content.put(html_content)
+    return content_hash, mond_variables, image_tasks, time.perf_counter() - start, images.pop_timings()
+
+# Per-process state for render_post, set up once per worker by init_render_worker
+_render_state = {}
+
+def init_render_worker(store, compiled_templates, output_blog_dir, minify_output=False):
+    _render_state.update(store=store, templates=compiled_templates, output_blog_dir=output_blog_dir,
+                         minify_output=minify_output)
+
+def render_post(filename, template_path, mond_variables):
+    """Render and write one post; returns (variables used, seconds taken, timings of the blocks it ran)."""
+    start = time.perf_counter()
+    used = set()
+    store = _render_state['store']
+    rendered_content = apply_template(store.content.read(mond_variables), mond_variables,
+                                      _render_state['templates'][template_path], store, used)
+    write_output(filename, rendered_content, _render_state['output_blog_dir'], _render_state['minify_output'])
+    return used, time.perf_counter() - start, store.blocks.pop_timings()
+
+def markdown_to_html(file_path, base_dir, output_dir, images, image_tasks):
     with open(file_path, 'r', encoding='utf-8') as file:
         text = file.read()
 
@@ -67,10 +246,10 @@ def markdown_to_html(file_path, base_dir, output_dir):
     front_matter, markdown_content = parse_front_matter(text)
 
     # Process images in markdown content
-    markdown_content = process_images_in_markdown(markdown_content, file_path, front_matter, base_dir, output_dir)
+    markdown_content = process_images_in_markdown(markdown_content, file_path, front_matter, base_dir, output_dir, images, image_tasks)
 
     # Convert markdown to HTML
-    html_content = markdown.markdown(markdown_content, extensions=[MetaExtension()])
+    html_content = convert_markdown(markdown_content)
 
     # Add extra metadata like page URL
     if 'page_url' not in front_matter:
@@ -78,14 +257,24 @@ def markdown_to_html(file_path, base_dir, output_dir):
 
     return html_content, front_matter
 
-def process_images_in_markdown(markdown_content, markdown_file_path, mond_variables, base_dir, output_dir):
-    # Regex pattern to find image references in markdown
-    # Pattern matches: ![alt text](image_path "title")
-    image_pattern = r'!\[(.*?)\]\((.*?)(?: "(.*?)")?\)'
-    matches = re.finditer(image_pattern, markdown_content)
-    new_markdown_content = markdown_content
+# One converter per process, reset between posts rather than built again for each
+_converter = None
+
+def convert_markdown(markdown_content):
+    global _converter
+    if _converter is None:
+        # Imported on the first post that needs converting, so builds with none never load markdown
+        import markdown
+        from markdown.extensions.meta import MetaExtension
+        _converter = markdown.Markdown(extensions=[MetaExtension()])
+    return _converter.reset().convert(markdown_content)
 
-    for match in matches:
+def process_images_in_markdown(markdown_content, markdown_file_path, mond_variables, base_dir, output_dir, images, image_tasks):
+    sanitized_title = ''.join(e for e in mond_variables.get('title', 'untitled') if e.isalnum())
+    output_image_dir = os.path.join(output_dir, 'images')
+    output_html_dir = os.path.join(output_dir, 'blog', mond_variables.get('date_posted', ''))
+
+    def replace(match):
         full_match = match.group(0)
         alt_text = match.group(1)
         image_path = match.group(2)
@@ -94,44 +283,41 @@ def process_images_in_markdown(markdown_content, markdown_file_path, mond_variab
         # Resolve the absolute path of the image relative to the markdown file
         image_source_path = os.path.abspath(os.path.join(os.path.dirname(markdown_file_path), image_path))
         if not os.path.exists(image_source_path):
-            print(f"Image not found: {image_source_path}")
-            continue
+            logger.warning(f"Image not found: {image_source_path}")
+            return full_match
 
-        # Generate new image filename with publish date and title
-        image_ext = os.path.splitext(image_source_path)[1]
-        sanitized_title = ''.join(e for e in mond_variables.get('title', 'untitled') if e.isalnum())
-        base_filename = f"{mond_variables.get('date_posted', 'unknown')}_{sanitized_title}"
+        # Encode (or find in the cache) the responsive variants of the image
+        variants = images.variants(image_source_path)['variants']
 
-        # Determine the image extension for the optimized image (PNG)
-        optimized_image_ext = '.png'
-
-        # Prepare optimized image filename and original image filename
-        optimized_image_filename = f"{base_filename}_optimized{optimized_image_ext}"
-        original_image_filename = f"{base_filename}_original{image_ext}"
+        # Generate new image filenames with publish date, title and the image's cache key,
+        # so every image of a post gets its own files
+        image_ext = os.path.splitext(image_source_path)[1]
+        base_filename = f"{mond_variables.get('date_posted', 'unknown')}_{sanitized_title}_{variants[0]['file'][:8]}"
 
         # Define the output paths for the images
-        output_image_dir = os.path.join(output_dir, 'images')
         if not os.path.exists(output_image_dir):
             os.makedirs(output_image_dir)
-        optimized_image_path = os.path.join(output_image_dir, optimized_image_filename)
-        original_image_path = os.path.join(output_image_dir, original_image_filename)
-
-        # Optimize the image and save it
-        dither_image(image_source_path, optimized_image_path)
-
-        # Copy the original image
-        copy_original_image(image_source_path, original_image_path)
-
-        # Update the image paths to be relative to the output HTML
-        output_html_dir = os.path.join(output_dir, 'blog', mond_variables.get('date_posted', ''))
-        relative_optimized_image_path = os.path.relpath(optimized_image_path, output_html_dir)
+        original_image_path = os.path.join(output_image_dir, f"{base_filename}_original{image_ext}")
+
+        # Queue every variant and the original to be placed in the output
+        srcset = []
+        for variant in variants:
+            variant_path = os.path.join(output_image_dir, f"{base_filename}_optimized_{variant['width']}w.{variant['format']}")
+            image_tasks.append((variant_path, variant['path']))
+            srcset.append(f"{os.path.relpath(variant_path, output_html_dir).replace(os.sep, '/')} {variant['width']}w")
+        image_tasks.append((original_image_path, image_source_path))
+
+        # Update the image paths to be relative to the output HTML; the widest variant is the plain src
+        largest = variants[-1]
+        relative_optimized_image_path = srcset[-1].rsplit(' ', 1)[0]
         relative_original_image_path = os.path.relpath(original_image_path, output_html_dir)
 
         # Generate unique ID for the image to be used in the JS
         image_id = f"image_{sanitized_title}_{match.start()}"
 
-        # Prepare the SVG icon (simple dither icon)
-        svg_icon = '''<svg onclick="swapImage('{image_id}', '{original_src}', '{optimized_src}')" style="cursor:pointer;width:16px;height:16px;" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 64 64">
+        # Prepare the SVG icon (simple dither icon). srcset wins over src, so it is
+        # dropped while the original is shown and put back when switching back
+        svg_icon = '''<svg onclick="var image = document.getElementById('{image_id}'); if (image.hasAttribute('srcset')) image.removeAttribute('srcset'); else image.srcset = image.dataset.srcset; swapImage('{image_id}', '{original_src}', '{optimized_src}')" style="cursor:pointer;width:16px;height:16px;" xmlns="http://www.w3.org/2000/svg" viewBox="0 0 64 64">
     <!-- Simple icon representing image quality toggle -->
     <circle cx="32" cy="32" r="30" stroke="black" stroke-width="2" fill="none"/>
     <circle cx="24" cy="24" r="2" fill="black"/>
@@ -141,13 +327,13 @@ def process_images_in_markdown(markdown_content, markdown_file_path, mond_variab
 </svg>'''.format(
             image_id=image_id,
             original_src=relative_original_image_path.replace('\\', '/'),
-            optimized_src=relative_optimized_image_path.replace('\\', '/')
+            optimized_src=relative_optimized_image_path
         )
 
-        # Prepare the HTML to replace the markdown image
-        image_html = textwrap.dedent('''\
+        # The HTML that takes the place of the markdown image
+        return textwrap.dedent('''\
             <div class="image-container">
-                <img id="{image_id}" src="{optimized_src}" alt="{alt_text}" data-optimized-src="{optimized_src}" data-original-src="{original_src}" data-original="false">
+                <img id="{image_id}" src="{optimized_src}" srcset="{srcset}" sizes="{sizes}" width="{width}" height="{height}" alt="{alt_text}" data-optimized-src="{optimized_src}" data-original-src="{original_src}" data-srcset="{srcset}" data-original="false">
                 {title_html}
                 <div class="image-footer">
                     {svg_icon}
@@ -155,68 +341,75 @@ def process_images_in_markdown(markdown_content, markdown_file_path, mond_variab
             </div>
         ''').format(
             image_id=image_id,
-            optimized_src=relative_optimized_image_path.replace('\\', '/'),
+            optimized_src=relative_optimized_image_path,
             original_src=relative_original_image_path.replace('\\', '/'),
+            srcset=', '.join(srcset),
+            sizes=f"(max-width: {largest['width']}px) 100vw, {largest['width']}px",
+            width=largest['width'],
+            height=largest['height'],
             alt_text=alt_text,
             title_html=f'<p>{title}</p>' if title else '',
             svg_icon=svg_icon
         )
 
-        # Replace the markdown image syntax with the custom HTML
-        new_markdown_content = new_markdown_content.replace(full_match, image_html)
-
-    return new_markdown_content
-
+    # Each reference is rewritten where it stands, in a single pass over the post
+    return IMAGE_PATTERN.sub(replace, markdown_content)
 
 def parse_front_matter(text):
-    pattern = r'^---\s+(.*?)\s+---\s+(.*)$'
-    match = re.search(pattern, text, re.DOTALL)
-    if match:
-        # Extract front matter and replace newline with comma, enclose keys and string values in double quotes
-        front_matter_text = match.group(1)
-        # Convert to a valid JSON string
-        json_str = front_matter_to_json(front_matter_text)
-        front_matter = json.loads(json_str)
-        content = match.group(2)
-    else:
-        front_matter = {}
-        content = text
-
-    return front_matter, content
-
-def front_matter_to_json(front_matter_text):
-    # Convert colon-separated key-value pairs to JSON
-    lines = front_matter_text.split('\n')
-    json_pieces = []
-    for line in lines:
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip().replace('\'', '').replace('"', '')
-            value = value.strip()
-            # Check if value is a string that needs quotes
-            if not value.isdigit() and not (value.startswith('[') and value.endswith(']')):
-                value = f'"{value}"'
-            json_pieces.append(f'"{key}": {value}')
-    json_str = '{' + ', '.join(json_pieces) + '}'
-    return json_str
-
-def write_output(filename, content, output_dir):
+    """Split a post into (front matter, markdown body).
+
+    Front matter is a block of `key: value` lines between two `---` lines at
+    the top of the post. Whole numbers become ints, `[...]` values lists, and
+    quotes around a value are dropped. Without a closing `---` the whole text
+    is the body.
+    """
+    position = text.find('\n')
+    if position == -1 or text[:position].strip() != '---':
+        return {}, text
+
+    front_matter = {}
+    position += 1
+    while position < len(text):
+        end = text.find('\n', position)
+        end = len(text) if end == -1 else end
+        line = text[position:end]
+        position = end + 1
+        if line.strip() == '---':
+            return front_matter, text[position:].lstrip()
+        key, colon, value = line.partition(':')
+        if colon:
+            front_matter[key.strip().replace('\'', '').replace('"', '')] = front_matter_value(value.strip())
+    return {}, text
+
+def front_matter_value(value):
+    if value.isdigit():
+        return int(value)
+    if value.startswith('[') and value.endswith(']'):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return [item.strip().strip('\'"') for item in value[1:-1].split(',') if item.strip()]
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+        return value[1:-1]
+    return value
+
+def front_matter_tags(value):
+    # Either a [a, b] list or the older space-separated string (a lone number comes back as an int)
+    if isinstance(value, list):
+        return [str(tag) for tag in value]
+    return str(value).split()
+
+def write_output(filename, content, output_dir, minify_output=False):
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
     output_path = os.path.join(output_dir, filename.replace('.md', '.html'))
-    with open(output_path, 'w', encoding='utf-8') as file:
-        file.write(content)
-
-    print(f"Blog processed and written to: {output_path}")
-
-def apply_template(html_content, mond_variables, template_path, variables_file):
-    with open(template_path, 'r', encoding='utf-8') as file:
-        template = file.read()
-
-    for key, value in mond_variables.items():
-        template = template.replace(f"{{-}}{{{key}}}", str(value))
+    if write_text_output(output_path, content, minify_output):
+        logger.debug(f"Blog processed and written to: {output_path}")
+    else:
+        logger.debug(f"Blog processed, unchanged: {output_path}")
 
+def apply_template(html_content, mond_variables, template, store, used=None):
     # Insert navigation links
     navigation_html = ""
     if mond_variables.get('prev_post'):
@@ -224,7 +417,5 @@ def apply_template(html_content, mond_variables, template_path, variables_file):
     if mond_variables.get('next_post'):
         navigation_html += f'<a href="{mond_variables["next_post"]}.html">Next Post</a>'
 
-    template = template.replace("{-}{navigation}", navigation_html)
-
-    final_rendered_content = substitute_variables(template, variables_file)
-    return final_rendered_content
+    # Fill every slot of the compiled template in one pass
+    return render_template(template, store, dict(mond_variables, content=html_content, navigation=navigation_html), used)
@@ -1,6 +1,41 @@
 import json
 import os
 
+# Settings every sonne.config starts with. Settings added in later versions of
+# Sonne fall back to these, so older config files keep working.
+DEFAULT_SETTINGS = {
+    'PagesDirectory': 'pages',
+    'BlogDirectory': 'blog',
+    'DitherImages': 'yes',
+    'IndexPage': 'index.html',
+    'SubstitutionTargets': ['html', 'css', 'js', 'md'],
+    'OutputDirectory': 'output',
+    'SourceDirectory': 'sonne_sources',
+    'VariablesFile': 'sonne_variables.json',
+    'PreservePriorVariables': False,
+    'BlogBase': 'blog_base.html',
+    'ArchiveBase': 'archive_base.html',
+    'ArchivePageSize': 10,
+    'SearchIndex': False,
+    'SearchPrefixLength': 2,
+    'CacheDirectory': '.sonne_cache',
+    'EmbeddedPythonWorkers': 0,
+    'EmbeddedPythonTimeout': 30,
+    'SourceTimeout': 60,
+    'SourceScripts': {},
+    'MinifyOutput': True,
+    'PrecompressOutput': True,
+    'PruneOutput': True,
+    'LinkAssets': True,
+    'ImageMode': 'dither',
+    'ImageWidths': [480, 960, 1600],
+    'ImageFormats': ['avif', 'webp', 'png'],
+    'ImageByteBudget': 150000,
+    'VariableHistory': False,
+    'HistoryFile': 'sonne_history.db',
+    'HistoryRetention': {'raw': 30, 'hour': 365, 'day': 0},
+}
+
 class Config:
     def __init__(self, config_path='sonne.config'):
         self.config_path = config_path
@@ -15,7 +50,8 @@ class Config:
             self.create_default_config()
 
     def get_setting(self, section, option):
-        return self.config.get(section, {}).get(option, None)
+        default = DEFAULT_SETTINGS.get(option) if section == 'DEFAULT' else None
+        return self.config.get(section, {}).get(option, default)
 
     def set_setting(self, section, option, value):
         if section not in self.config:
@@ -29,18 +65,7 @@ class Config:
 
     def create_default_config(self):
         self.config = {
-            'DEFAULT': {
-                'PagesDirectory': 'pages',
-                'BlogDirectory': 'blog',
-                'DitherImages': 'yes',
-                'IndexPage': 'index.html',
-                'SubstitutionTargets': ['html', 'css', 'js', 'md'],
-                'OutputDirectory': 'output',
-                'SourceDirectory': 'sonne_sources',
-                'VariablesFile': 'sonne_variables.json',
-                'PreservePriorVariables': False,
-                'BlogBase': 'blog_base.html'
-            }
+            'DEFAULT': dict(DEFAULT_SETTINGS)
         }
         self.save_config()
 
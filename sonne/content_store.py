@@ -0,0 +1,56 @@
+# content_store.py
+
+import os
+from sonne.manifest import hash_bytes
+from sonne.postprocess import write_if_changed
+
+class ContentStore:
+    """Rendered blog post bodies, kept out of the variables file.
+
+    Bodies are stored under their content hash, which every all_blog_posts
+    entry carries as 'content_hash', and are only read from disk when a
+    template or embedded block asks for them.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._loaded = {}
+
+    def put(self, html_content):
+        content_hash = hash_bytes(html_content.encode('utf-8'))
+        path = self._path(content_hash)
+        if not os.path.exists(path):
+            os.makedirs(self.directory, exist_ok=True)
+            write_if_changed(path, html_content.encode('utf-8'))
+        self._loaded[content_hash] = html_content
+        return content_hash
+
+    def has(self, content_hash):
+        return content_hash in self._loaded or os.path.exists(self._path(content_hash))
+
+    def read(self, post):
+        """Body of a post, given its all_blog_posts entry or its content hash."""
+        content_hash = post['content_hash'] if isinstance(post, dict) else post
+        if content_hash not in self._loaded:
+            with open(self._path(content_hash), 'r', encoding='utf-8') as file:
+                self._loaded[content_hash] = file.read()
+        return self._loaded[content_hash]
+
+    def prune(self, keep):
+        # Drop bodies of deleted or edited posts
+        self._loaded = {content_hash: body for content_hash, body in self._loaded.items() if content_hash in keep}
+        if not os.path.exists(self.directory):
+            return
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.html') and filename[:-5] not in keep:
+                os.remove(os.path.join(self.directory, filename))
+
+    def __getstate__(self):
+        # Workers get the location only and load bodies as they need them
+        return {'directory': self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'])
+
+    def _path(self, content_hash):
+        return os.path.join(self.directory, content_hash + '.html')
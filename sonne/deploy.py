@@ -0,0 +1,84 @@
+# deploy.py
+
+import os
+import json
+import logging
+from datetime import datetime
+from sonne.manifest import hash_file, PRIVATE_PREFIX
+from sonne.postprocess import write_if_changed
+
+DEPLOY_FILENAME = '.sonne_deploy.json'
+DEPLOY_VERSION = 1
+SIBLING_EXTENSIONS = ('.gz', '.br', '.zst')
+
+logger = logging.getLogger(__name__)
+
+def output_files(output_dir):
+    """Paths (relative to output_dir) of every published output; Sonne's own files such as the manifests are not."""
+    for root, dirs, files in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(PRIVATE_PREFIX)]
+        for file in files:
+            if not file.startswith(PRIVATE_PREFIX) and not file.endswith('.tmp'):
+                yield os.path.relpath(os.path.join(root, file), output_dir)
+
+def prune_outputs(output_dir, manifest):
+    """Delete outputs a full build did not produce, such as pages of deleted posts or renamed pages.
+
+    Precompressed siblings go with their output, and directories left empty are removed.
+    """
+    removed = []
+    for rel_path in list(output_files(output_dir)):
+        base, extension = os.path.splitext(rel_path)
+        if rel_path in manifest.kept or (extension in SIBLING_EXTENSIONS and base in manifest.kept):
+            continue
+        os.remove(os.path.join(output_dir, rel_path))
+        removed.append(rel_path)
+
+    for root, dirs, files in os.walk(output_dir, topdown=False):
+        if root != output_dir and not os.listdir(root):
+            os.rmdir(root)
+    if removed:
+        logger.info(f"Pruned {len(removed)} stale outputs.")
+    return removed
+
+def write_deploy_manifest(output_dir):
+    """Record every output with its hash, and what was added, changed or deleted since the last build.
+
+    Written to .sonne_deploy.json in the output directory for sync and upload
+    scripts. Hashes of files whose size and mtime did not change are reused.
+    """
+    path = os.path.join(output_dir, DEPLOY_FILENAME)
+    previous = {}
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == DEPLOY_VERSION:
+                previous = data['files']
+        except (OSError, ValueError):
+            pass
+
+    files = {}
+    for rel_path in output_files(output_dir):
+        stat = os.stat(os.path.join(output_dir, rel_path))
+        entry = previous.get(rel_path)
+        if not (entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns):
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                     'hash': hash_file(os.path.join(output_dir, rel_path))}
+        files[rel_path] = entry
+
+    added = {rel_path: entry['hash'] for rel_path, entry in files.items() if rel_path not in previous}
+    changed = {rel_path: entry['hash'] for rel_path, entry in files.items()
+               if rel_path in previous and previous[rel_path]['hash'] != entry['hash']}
+    deleted = {rel_path: entry['hash'] for rel_path, entry in previous.items() if rel_path not in files}
+
+    write_if_changed(path, json.dumps({
+        'version': DEPLOY_VERSION,
+        'built': datetime.now().isoformat(),
+        'added': dict(sorted(added.items())),
+        'changed': dict(sorted(changed.items())),
+        'deleted': dict(sorted(deleted.items())),
+        'files': dict(sorted(files.items())),
+    }, indent=1).encode('utf-8'))
+    logger.info(f"Deploy manifest: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted.")
+    return added, changed, deleted
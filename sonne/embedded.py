@@ -0,0 +1,266 @@
+# embedded.py
+
+import ast
+import hashlib
+import os
+import re
+import signal
+import threading
+import time
+import logging
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; CPU limits are skipped there
+    resource = None
+
+ERROR_OUTPUT = "Error in Python Code"
+
+# A block marked `# sonne: volatile` (one reading the clock, say) depends on this, which changes every build
+VOLATILE = '@volatile'
+VOLATILE_PATTERN = re.compile(r'^\s*#\s*sonne:.*\bvolatile\b', re.MULTILINE)
+
+logger = logging.getLogger(__name__)
+
+class BlockTimeout(BaseException):
+    # A BaseException so `except Exception` inside a block cannot swallow it
+    pass
+
+def _raise_timeout(signum, frame):
+    raise BlockTimeout()
+
+def compile_block(python_code):
+    # Prepare code for execution to properly capture the output without using 'return'
+    complete_code = f'result = None\n{python_code}\n'  # Assuming the code modifies 'result'
+    return compile(complete_code, '<sonne embedded python>', 'exec')
+
+def execute_block(code, variables, timeout=None, helpers=None):
+    """Run a compiled block against the variables, returning (ok, output or error message).
+
+    When timeout is set and we are on the main thread, the block is stopped
+    after `timeout` seconds of wall time or CPU time, whichever comes first.
+    """
+    limited = bool(timeout) and hasattr(signal, 'setitimer') and threading.current_thread() is threading.main_thread()
+    if limited:
+        previous_alarm = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+        if resource is not None:
+            previous_xcpu = signal.signal(signal.SIGXCPU, _raise_timeout)
+            cpu_soft, cpu_hard = resource.getrlimit(resource.RLIMIT_CPU)
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            cpu_limit = int(usage.ru_utime + usage.ru_stime + timeout) + 1
+            if cpu_hard == resource.RLIM_INFINITY or cpu_limit < cpu_hard:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_limit, cpu_hard))
+    try:
+        # Create a local scope, including the data dictionary and helpers such as content()
+        local_scope = dict(helpers or {}, data=variables)
+        exec(code, {}, local_scope)  # Execute the prepared code in the local scope
+        # Retrieve the 'result' variable set by the executed code
+        return True, str(local_scope['result']) if 'result' in local_scope else ''
+    except BlockTimeout:
+        return False, f"timed out after {timeout}s"
+    except Exception as e:
+        return False, str(e)
+    finally:
+        if limited:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_alarm)
+            if resource is not None:
+                resource.setrlimit(resource.RLIMIT_CPU, (cpu_soft, cpu_hard))
+                signal.signal(signal.SIGXCPU, previous_xcpu)
+
+# Per-process state of block pool workers
+_worker_variables = None
+_worker_helpers = None
+_worker_code = {}
+
+def _init_block_worker(variables, helpers):
+    global _worker_variables, _worker_helpers
+    _worker_variables = variables
+    _worker_helpers = helpers
+
+def _run_block_in_worker(block_hash, python_code, timeout):
+    start = time.perf_counter()
+    if block_hash not in _worker_code:
+        _worker_code[block_hash] = compile_block(python_code)
+    ok, output = execute_block(_worker_code[block_hash], _worker_variables, timeout, _worker_helpers)
+    return ok, output, time.perf_counter() - start
+
+class BlockEngine:
+    """Executes embedded {p}{#...#} Python blocks for a build.
+
+    Each distinct block is compiled once, and its output is memoized on the
+    block hash plus the hash of the variable snapshot it ran against, so a
+    snippet shared by dozens of pages runs once per build. With workers > 0
+    blocks run in a pool of worker processes, which lets a page's blocks run
+    concurrently and lets a runaway block be killed without hanging the build.
+    """
+
+    def __init__(self, workers=0, timeout=None, helpers=None):
+        self.workers = workers
+        self.timeout = timeout
+        self.helpers = helpers or {}  # extra names blocks can use next to `data`
+        self.code = {}          # block hash -> code object
+        self.dependencies = {}  # block hash -> names of the variables the block reads
+        self.results = {}       # (block hash, hash of those variables) -> output
+        self.timings = {}       # block_label() -> [seconds spent running it, runs], see pop_timings
+        self.used = set()       # keys of self.results looked up since the last forget_unused()
+        self._pool = None
+        self._pool_snapshot = None
+        self._pid = os.getpid()
+
+    def __getstate__(self):
+        # Sent to blog render workers: keep the memoized results, not the pool or code objects
+        return {'workers': 0, 'timeout': self.timeout, 'helpers': self.helpers,
+                'results': self.results, 'dependencies': self.dependencies}
+
+    def __setstate__(self, state):
+        self.__init__(state['workers'], state['timeout'], state['helpers'])
+        self.results = state['results']
+        self.dependencies = state['dependencies']
+
+    def block_dependencies(self, python_code):
+        digest = block_hash(python_code)
+        if digest not in self.dependencies:
+            self.dependencies[digest] = find_data_references(python_code)
+        return self.dependencies[digest]
+
+    def run(self, python_code, variables, variable_hashes):
+        return self.run_many([python_code], variables, variable_hashes)[0]
+
+    def run_many(self, python_codes, variables, variable_hashes):
+        """Outputs of the given blocks, executing only the ones not already memoized.
+
+        A block's output is reused for as long as the variables it reads keep
+        their hashes, so refreshing one value only re-runs the blocks reading it.
+        """
+        keys = [(block_hash(code), hash_names(self.block_dependencies(code), variable_hashes))
+                for code in python_codes]
+        snapshot = variable_hashes['*']
+        missing = {}
+        self.used.update(keys)
+        for key, code in zip(keys, python_codes):
+            if key not in self.results:
+                missing[key] = code
+        if missing:
+            # A forked blog render worker inherits the engine but must not touch its parent's pool
+            if self.workers > 0 and os.getpid() == self._pid:
+                outcomes = self._run_in_pool(missing, variables, snapshot)
+            else:
+                outcomes = {key: self._run_here(key[0], code, variables) for key, code in missing.items()}
+            for key, (ok, output, seconds) in outcomes.items():
+                timing = self.timings.setdefault(block_label(missing[key]), [0.0, 0])
+                timing[0] += seconds
+                timing[1] += 1
+                if not ok:
+                    logger.error(f"Error executing embedded Python: {output}")
+                    output = ERROR_OUTPUT
+                self.results[key] = output
+        return [self.results[key] for key in keys]
+
+    def forget_unused(self):
+        # A long-running `sonne serve` drops outputs of blocks and variable values no build uses any more
+        self.results = {key: output for key, output in self.results.items() if key in self.used}
+        self.used = set()
+
+    def pop_timings(self):
+        # Handed back by render workers, whose blocks would otherwise go untimed
+        timings, self.timings = self.timings, {}
+        return timings
+
+    def _run_here(self, block_hash, python_code, variables):
+        logger.debug(f'----EXECUTION BLOCK-----\n\n{python_code}\n\n----/EXECUTION BLOCK----')
+        start = time.perf_counter()
+        try:
+            if block_hash not in self.code:
+                self.code[block_hash] = compile_block(python_code)
+        except SyntaxError as e:
+            return False, str(e), time.perf_counter() - start
+        ok, output = execute_block(self.code[block_hash], variables, self.timeout, self.helpers)
+        return ok, output, time.perf_counter() - start
+
+    def _run_in_pool(self, missing, variables, snapshot):
+        import multiprocessing  # Only block worker pools need it
+        outcomes = {}
+        remaining = dict(missing)
+        while remaining:
+            if self._pool is None or self._pool_snapshot != snapshot:
+                # Workers hold a copy of the variables, so a new snapshot needs fresh workers
+                self.close()
+                self._pool = multiprocessing.Pool(self.workers, _init_block_worker, (variables, self.helpers))
+                self._pool_snapshot = snapshot
+
+            pending = {key: self._pool.apply_async(_run_block_in_worker, (key[0], code, self.timeout))
+                       for key, code in remaining.items()}
+            for key, result in pending.items():
+                try:
+                    # Workers enforce the limit themselves; the grace period catches blocks stuck in C code
+                    outcomes[key] = result.get(None if self.timeout is None else self.timeout + 5)
+                except multiprocessing.TimeoutError:
+                    outcomes[key] = (False, f"timed out after {self.timeout}s", self.timeout)
+                    # Kill the stuck worker; blocks that had not finished yet are resubmitted
+                    self.close()
+                    break
+                except Exception as e:
+                    outcomes[key] = (False, str(e), 0.0)
+            remaining = {key: code for key, code in remaining.items() if key not in outcomes}
+        return outcomes
+
+    def close(self):
+        if self._pool is not None and os.getpid() == self._pid:
+            self._pool.terminate()
+            self._pool.join()
+        self._pool = None
+
+def block_hash(python_code):
+    return hashlib.sha256(python_code.encode('utf-8')).hexdigest()
+
+def block_label(python_code):
+    # How a block is named in build reports: its first line and a short hash
+    first_line = python_code.strip().splitlines()[0] if python_code.strip() else ''
+    return f"{first_line[:60]} [{block_hash(python_code)[:8]}]"
+
+def hash_names(names, variable_hashes):
+    if '*' in names:
+        if VOLATILE not in names:
+            return variable_hashes['*']
+        names = {'*', VOLATILE}
+    return hashlib.sha256(repr([(name, variable_hashes.get(name)) for name in sorted(names)]).encode('utf-8')).hexdigest()
+
+def find_data_references(python_code):
+    """Names a block reads through data['name'] or data.get('name'), plus name@history for history('name').
+
+    Any other use of `data` (iterating it, passing it around, computed keys)
+    could read anything, so it yields {'*'}. A block reading nothing is
+    memoized for good unless it is marked `# sonne: volatile`, which adds
+    VOLATILE.
+    """
+    volatile = {VOLATILE} if VOLATILE_PATTERN.search(python_code) else set()
+    try:
+        tree = ast.parse(python_code)
+    except SyntaxError:
+        return {'*'} | volatile
+
+    parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    names = set(volatile)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'history':
+            if not (node.args and isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str)):
+                return {'*'} | volatile
+            names.add(node.args[0].value + '@history')
+            continue
+        if not (isinstance(node, ast.Name) and node.id == 'data'):
+            continue
+        parent = parents.get(node)
+        if (isinstance(parent, ast.Subscript) and parent.value is node
+                and isinstance(parent.slice, ast.Constant) and isinstance(parent.slice.value, str)):
+            names.add(parent.slice.value)
+            continue
+        call = parents.get(parent)
+        if (isinstance(parent, ast.Attribute) and parent.attr == 'get'
+                and isinstance(call, ast.Call) and call.func is parent and call.args
+                and isinstance(call.args[0], ast.Constant) and isinstance(call.args[0].value, str)):
+            names.add(call.args[0].value)
+            continue
+        return {'*'} | volatile
+    return names
@@ -1,76 +1,369 @@
 import os
-from sonne.variable_manager import process_variables, substitute_variables
+import time
+import logging
+from sonne.variable_manager import process_variables, VariableStore
 from sonne.config import Config
-from sonne.blog import process_blogs
-from sonne.images import optimize_images
-
-def generate_site(base_dir):
-    print("Starting site generation...")
-    config = Config(os.path.join(base_dir, 'sonne.config'))
-    
-    # Ensure output directory exists
-    output_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'OutputDirectory'))
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-    
+from sonne.manifest import BuildManifest, hash_value, PRIVATE_PREFIX
+from sonne.parallel import default_jobs
+from sonne.embedded import BlockEngine, VOLATILE
+from sonne.content_store import ContentStore
+from sonne.postprocess import write_text_output, precompress_outputs, can_minify
+from sonne.assets import copy_asset, has_markers, stream_substitute, STREAM_THRESHOLD
+from sonne.deploy import prune_outputs, write_deploy_manifest
+from sonne.blog import process_blogs, publish_posts, refresh_posts
+from sonne.archives import build_indexes, render_archives
+from sonne.search import SearchIndex
+from sonne.shards import (in_shard, shard_directory, write_shard_record, find_shards, collect_outputs, merge_posts,
+                          check_posts, merge_manifests, copy_outputs, CONTENT_DIRECTORY)
+from sonne.images import optimize_images, ImagePipeline, image_settings
+from sonne.templates import TemplateCache
+from sonne.stats import BuildStats
+from sonne.stamp import input_snapshot, clear_stamp, write_stamp
+
+logger = logging.getLogger(__name__)
+
+class SiteState:
+    """Everything a build loads before it starts: config, build manifest, variables and caches.
+
+    A one-off build makes a fresh one; `sonne serve` keeps one between builds
+    so compiled templates, block outputs, post bodies and the manifest stay
+    in memory. A changed sonne.config needs a new SiteState.
+
+    The state of a shard build (shard is (i, N)) points at the shard's own
+    output tree, which also holds its post bodies.
+    """
+
+    def __init__(self, base_dir, shard=None, config=None):
+        self.base_dir = base_dir
+        self.shard = shard
+        self.config = config if config is not None else Config(os.path.join(base_dir, 'sonne.config'))
+        if shard is None:
+            self.output_dir = os.path.join(base_dir, self.config.get_setting('DEFAULT', 'OutputDirectory'))
+        else:
+            self.output_dir = shard_directory(base_dir, self.config, shard)
+        # The record of the last build, so unchanged outputs can be skipped
+        self.manifest = BuildManifest(self.output_dir, hash_value(self.config.config))
+        # Variables are held in memory for the whole build and written back once
+        self.store = create_store(base_dir, self.config,
+                                  os.path.join(self.output_dir, CONTENT_DIRECTORY) if shard is not None else None)
+        self.templates = TemplateCache()
+        self.images = ImagePipeline(os.path.join(base_dir, self.config.get_setting('DEFAULT', 'CacheDirectory')),
+                                    image_settings(self.config))
+        self.search = None
+        if self.config.get_setting('DEFAULT', 'SearchIndex') and shard is None:
+            self.search = SearchIndex(os.path.join(base_dir, self.config.get_setting('DEFAULT', 'CacheDirectory')),
+                                      self.config.get_setting('DEFAULT', 'SearchPrefixLength'))
+
+    def begin(self, force=False):
+        self.manifest.begin(force)
+        self.store.reset()
+
+    def finish(self):
+        # Forget block outputs that this build did not use, so a long-lived state does not grow without bound
+        self.store.blocks.forget_unused()
+
+    def close(self):
+        self.store.blocks.close()
+        if self.store.history is not None:
+            self.store.history.close()
+
+def generate_site(base_dir, force=False, jobs=None, stats=None, state=None, shard=None, config=None):
+    """Build the site in base_dir; returns the BuildStats of the build (filled into stats if given).
+
+    Pass a SiteState to build from one kept in memory, as `sonne serve` does,
+    or the site's Config if it is already loaded. With shard as (i, N), only
+    build the i-th of N disjoint parts of the site into a tree of its own,
+    for `sonne merge` to combine.
+    """
+    logger.info("Starting site generation...")
+    stats = stats if stats is not None else BuildStats()
+    owned = state is None
+    due = None
+    with stats.stage('setup'):
+        state = state if state is not None else SiteState(base_dir, shard, config)
+        state.begin(force)
+        config, manifest, store, output_dir, shard = state.config, state.manifest, state.store, state.output_dir, state.shard
+        if shard is None:
+            # Taken before anything is read, so a file edited during the build is built again next time
+            snapshot = input_snapshot(base_dir, config)
+            clear_stamp(base_dir, config)
+
+        # Ensure output directory exists
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+    jobs = jobs or default_jobs()
+
     # Process variables in all documents
-    process_variables(base_dir, config)
+    with stats.stage('variables'):
+        if shard is None:
+            due = process_variables(base_dir, config, store, jobs, stats)
+        else:
+            # Source scripts run once, in the merge; shards render with what the last build left
+            store.load()
 
     # Generate blog pages from markdown files
-    process_blogs(base_dir, output_dir, config)
+    with stats.stage('blogs'):
+        blog_posts = process_blogs(base_dir, output_dir, config, manifest, store, jobs, state.templates, stats,
+                                   state.images, shard)
+        if shard is not None:
+            write_shard_record(output_dir, shard, base_dir, manifest.config_hash, blog_posts)
+
+    # Index post titles, tags and bodies for search.js, rewriting only the shards that changed
+    if state.search is not None:
+        with stats.stage('search'):
+            state.search.update(store.get('all_blog_posts') or [], store.content, output_dir, manifest)
 
     # Process and copy files
-    process_and_copy_files(base_dir, output_dir, config)
+    with stats.stage('pages'):
+        process_and_copy_files(base_dir, output_dir, config, manifest, store, stats, shard)
+
+    # Remove outputs of deleted posts and renamed pages
+    if config.get_setting('DEFAULT', 'PruneOutput'):
+        with stats.stage('prune'):
+            prune_outputs(output_dir, manifest)
+
+    # A shard tree is not published as it is; the merge does these for the whole site
+    if shard is None:
+        finish_output(output_dir, config, stats)
+
+    with stats.stage('save'):
+        if owned:
+            state.close()
+        if shard is None:
+            # A shard only reads the variables file, so shards can run side by side
+            store.flush()
+        manifest.save()
+        if shard is None:
+            # Lets the next `sonne` skip the build when nothing changed, see up_to_date; pages with
+            # volatile blocks need rendering every time
+            write_stamp(base_dir, config, snapshot, time.time() if manifest.reads(VOLATILE) else due)
 
     # Optimize images
     optimize_images(base_dir, output_dir)
 
-    print("Site generation completed.")
+    # Blocks run in this process; render workers already handed theirs back
+    stats.merge('block', store.blocks.pop_timings())
+    state.finish()
+    stats.finish()
+    logger.info(f"Site generation completed in {stats.total:.2f}s.")
+    return stats
 
-def process_and_copy_files(source_dir, output_dir, config):
+def refresh_site(base_dir, stats=None, state=None, config=None):
+    """Re-run the source scripts and re-render only the outputs that read a variable that changed."""
+    logger.info("Refreshing variables...")
+    stats = stats if stats is not None else BuildStats()
+    owned = state is None
+    with stats.stage('setup'):
+        state = state if state is not None else SiteState(base_dir, config=config)
+        state.begin()
+        config, manifest, store, output_dir = state.config, state.manifest, state.store, state.output_dir
+        # Start from everything the last build produced, such as all_blog_posts
+        store.load()
+
+    with stats.stage('variables'):
+        process_variables(base_dir, config, store, default_jobs(), stats)
+
+    stale = manifest.variable_dependents(store.hashes())
+    with stats.stage('pages'):
+        for output_path, rebuild in stale:
+            if rebuild and rebuild['kind'] == 'page':
+                substitute_and_write_file(rebuild['source'], output_path, manifest, store,
+                                          config.get_setting('DEFAULT', 'MinifyOutput'), stats)
+    with stats.stage('blogs'):
+        refresh_posts([rebuild for output_path, rebuild in stale if rebuild and rebuild['kind'] == 'post'],
+                      base_dir, output_dir, config, manifest, store, state.templates, stats)
+        if any(rebuild and rebuild['kind'] == 'archive' for output_path, rebuild in stale):
+            # Archive pages are cheap; unchanged ones are skipped by the manifest as usual
+            blog_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'BlogDirectory'))
+            render_archives(build_indexes(store.get('all_blog_posts') or []), blog_dir, output_dir, config,
+                            manifest, store, state.templates, stats)
+    finish_output(output_dir, config, stats)
+
+    with stats.stage('save'):
+        if owned:
+            state.close()
+        store.flush()
+        # Nothing outside the stale outputs was looked at, so keep the rest of the manifest as it is
+        manifest.save(prune=False)
+    stats.merge('block', store.blocks.pop_timings())
+    stats.finish()
+    logger.info(f"Refresh completed, {len(stale)} outputs depended on changed variables.")
+    return stats
+
+def merge_site(base_dir, force=False, jobs=None, stats=None, config=None):
+    """Combine the trees of a set of `sonne --shard i/N` builds into the site's output directory.
+
+    Runs the source scripts, copies over every file the shards wrote, then
+    does the parts that need the whole site: linking and rendering the posts,
+    the archives and the search index, and re-rendering shard pages that read
+    variables which have changed since. Raises MergeError when the shards
+    are incomplete or would overwrite each other.
+    """
+    logger.info("Merging shard builds...")
+    stats = stats if stats is not None else BuildStats()
+    base_dir = os.path.abspath(base_dir)
+    with stats.stage('setup'):
+        state = SiteState(base_dir, config=config)
+        state.begin(force)
+        config, manifest, store, output_dir = state.config, state.manifest, state.store, state.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        shards = find_shards(base_dir, config, manifest.config_hash)
+        owners = collect_outputs(shards)
+        blog_posts = merge_posts(shards, store.content)
+        check_posts(blog_posts, config.get_setting('DEFAULT', 'BlogDirectory'), owners)
+    logger.info(f"Merging {len(shards)} shards: {len(owners)} files and {len(blog_posts)} posts.")
+
+    jobs = jobs or default_jobs()
+    with stats.stage('variables'):
+        process_variables(base_dir, config, store, jobs, stats)
+
+    with stats.stage('blogs'):
+        publish_posts(blog_posts, base_dir, output_dir, config, manifest, store, jobs, state.templates, stats)
+
+    if state.search is not None:
+        with stats.stage('search'):
+            state.search.update(store.get('all_blog_posts') or [], store.content, output_dir, manifest)
+
+    with stats.stage('pages'):
+        merge_manifests(shards, owners, base_dir, output_dir, manifest)
+        # Pages whose variables (all_blog_posts above all) differ from what their shard saw are rendered again
+        stale = [(output_path, rebuild) for output_path, rebuild in manifest.variable_dependents(store.hashes())
+                 if rebuild and rebuild['kind'] == 'page' and os.path.relpath(output_path, output_dir) in owners]
+        copied = copy_outputs(owners, output_dir, manifest, config.get_setting('DEFAULT', 'LinkAssets'),
+                              {os.path.relpath(output_path, output_dir) for output_path, rebuild in stale})
+        for output_path, rebuild in stale:
+            substitute_and_write_file(rebuild['source'], output_path, manifest, store,
+                                      config.get_setting('DEFAULT', 'MinifyOutput'), stats)
+    logger.info(f"Copied {copied} changed shard outputs and re-rendered {len(stale)} pages.")
+
+    if config.get_setting('DEFAULT', 'PruneOutput'):
+        with stats.stage('prune'):
+            prune_outputs(output_dir, manifest)
+    finish_output(output_dir, config, stats)
+
+    with stats.stage('save'):
+        state.close()
+        store.flush()
+        manifest.save()
+    stats.merge('block', store.blocks.pop_timings())
+    stats.finish()
+    logger.info(f"Merge completed in {stats.total:.2f}s.")
+    return stats
+
+def finish_output(output_dir, config, stats):
+    # Write .gz/.br/.zst siblings for static serving
+    if config.get_setting('DEFAULT', 'PrecompressOutput'):
+        with stats.stage('precompress'):
+            precompress_outputs(output_dir)
+
+    # List what changed for the sync step
+    with stats.stage('deploy'):
+        added, changed, deleted = write_deploy_manifest(output_dir)
+    stats.files_written = len(added) + len(changed)
+
+def create_store(base_dir, config, content_dir=None):
+    # Post bodies live in the content store; embedded Python reads them with content(post)
+    content = ContentStore(content_dir or os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'), 'content'))
+    helpers = {'content': content.read}
+    history = None
+    if config.get_setting('DEFAULT', 'VariableHistory'):
+        from sonne.history import VariableHistory  # Loads sqlite3, which most sites never need
+        # and past values of variables with history(name, period, ...)
+        history = VariableHistory(os.path.join(base_dir, config.get_setting('DEFAULT', 'HistoryFile')),
+                                  config.get_setting('DEFAULT', 'HistoryRetention'))
+        helpers['history'] = history.series
+    blocks = BlockEngine(config.get_setting('DEFAULT', 'EmbeddedPythonWorkers'),
+                         config.get_setting('DEFAULT', 'EmbeddedPythonTimeout'),
+                         helpers)
+    return VariableStore(os.path.join(base_dir, config.get_setting('DEFAULT', 'VariablesFile')), blocks, content, history)
+
+def process_and_copy_files(source_dir, output_dir, config, manifest, store, stats=None, shard=None):
     # Define exclusions and target extensions
     exclusions = [config.get_setting('DEFAULT', 'OutputDirectory'),
                   config.get_setting('DEFAULT', 'SourceDirectory'),
                   config.get_setting('DEFAULT', 'BlogDirectory'),
+                  config.get_setting('DEFAULT', 'CacheDirectory'),
+                  os.path.basename(config.get_setting('DEFAULT', 'VariablesFile')),
                   'sonne.config',
-                  ]
+                  ] + history_files(config)
     target_ext = config.get_setting('DEFAULT', 'SubstitutionTargets')
-
+    stats = stats if stats is not None else BuildStats()
 
     # Process each file within the source directory
+    counts = {'rendered': 0, 'unchanged': 0, 'copied': 0}
     for root, dirs, files in os.walk(source_dir):
-        dirs[:] = [d for d in dirs if d not in exclusions]  # Skip excluded directories
-        process_directory(root, dirs, files, source_dir, output_dir, exclusions, target_ext, config)
+        dirs[:] = [d for d in dirs if d not in exclusions and not d.startswith(PRIVATE_PREFIX)]  # Skip excluded directories
+        process_directory(root, dirs, files, source_dir, output_dir, exclusions, target_ext, config, manifest, store,
+                          stats, counts, shard)
+    logger.info(f"Processed {counts['rendered']} pages, skipped {counts['unchanged']} unchanged ones "
+                f"and copied {counts['copied']} assets.")
+
+def history_files(config):
+    # The history database and the files SQLite keeps next to it
+    name = os.path.basename(config.get_setting('DEFAULT', 'HistoryFile'))
+    return [name, name + '-wal', name + '-shm', name + '-journal']
 
-def process_directory(root, dirs, files, base_dir, output_dir, exclusions, target_ext, config):
+def process_directory(root, dirs, files, base_dir, output_dir, exclusions, target_ext, config, manifest, store,
+                      stats=None, counts=None, shard=None):
     rel_path = os.path.relpath(root, base_dir)  # Ensure relative path is calculated from base_dir
     if any(excl in rel_path.split(os.sep) for excl in exclusions):
         return  # Skip processing this directory and its files
+    counts = counts if counts is not None else {'rendered': 0, 'unchanged': 0, 'copied': 0}
 
     output_subdir = os.path.join(output_dir, rel_path)
     if not os.path.exists(output_subdir):
         os.makedirs(output_subdir)
 
     for file in files:
-        if file in exclusions or not any(file.endswith(ext) for ext in target_ext):
-            continue  # Skip excluded files and non-target files
+        if file in exclusions or file.startswith(PRIVATE_PREFIX):
+            continue  # Skip excluded files and Sonne's own; .htaccess and the like are copied
 
         source_file_path = os.path.join(root, file)
+        if not in_shard(os.path.relpath(source_file_path, base_dir), shard):
+            continue  # Another shard's
         output_file_path = os.path.join(output_subdir, file)
-        substitute_and_write_file(source_file_path, output_file_path, base_dir, config)
+        if any(file.endswith(ext) for ext in target_ext):
+            rendered = substitute_and_write_file(source_file_path, output_file_path, manifest, store,
+                                                 config.get_setting('DEFAULT', 'MinifyOutput'), stats)
+            counts['rendered' if rendered else 'unchanged'] += 1
+        else:
+            # Fonts, images, downloads and so on pass straight through
+            if copy_asset(source_file_path, output_file_path, config.get_setting('DEFAULT', 'LinkAssets')):
+                logger.debug(f"Copied: {source_file_path} to {output_file_path}")
+                counts['copied'] += 1
+            manifest.keep(output_file_path)
 
-def substitute_and_write_file(source_file_path, output_file_path, base_dir, config):
-    with open(source_file_path, 'r') as f:
-        content = f.read()
+def substitute_and_write_file(source_file_path, output_file_path, manifest, store, minify_output=False, stats=None):
+    """Substitute one page into the output; returns False when it was skipped as unchanged."""
+    # Skip pages whose source and the variables they used are unchanged since the last build
+    inputs = {'source': manifest.file_hash(source_file_path)}
+    if manifest.is_fresh(output_file_path, inputs, store.hashes()):
+        return False
 
-    # Fetch the path of the variables file from the base directory as specified in the configuration
-    variables_file = os.path.join(base_dir, config.get_setting('DEFAULT', 'VariablesFile'))
+    start = time.perf_counter()
+    used = set()
+    if os.path.getsize(source_file_path) > STREAM_THRESHOLD:
+        # Too big to hold in memory comfortably; substituted chunk by chunk and not minified
+        changed = stream_substitute(source_file_path, output_file_path, store, used)
+    elif not has_markers(source_file_path) and not (minify_output and can_minify(output_file_path)):
+        # Nothing to substitute or minify, so it is copied as is
+        changed = copy_asset(source_file_path, output_file_path, link=False)
+    else:
+        with open(source_file_path, 'r') as f:
+            content = f.read()
 
-    # Substitute variables in the content using the variables file path
-    updated_content = substitute_variables(content, variables_file)
+        # Substitute variables in the content from the in-memory variable store
+        updated_content = store.substitute(content, used=used)
 
-    with open(output_file_path, 'w') as f:
-        f.write(updated_content)
+        changed = write_text_output(output_file_path, updated_content, minify_output)
+    manifest.record(output_file_path, inputs, used, store.hashes(), {'kind': 'page', 'source': source_file_path})
 
-    print(f"Processed and copied: {source_file_path} to {output_file_path}")
+    if stats is not None:
+        stats.record('file', os.path.relpath(output_file_path, manifest.output_dir), time.perf_counter() - start)
+    if changed:
+        logger.debug(f"Processed and copied: {source_file_path} to {output_file_path}")
+    else:
+        logger.debug(f"Processed, unchanged: {output_file_path}")
+    return True
 
@@ -0,0 +1,160 @@
+# history.py
+
+import os
+import json
+import sqlite3
+from datetime import datetime
+from sonne.manifest import hash_value
+
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (name TEXT NOT NULL, time REAL NOT NULL, value REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS samples_by_name ON samples (name, time);
+CREATE TABLE IF NOT EXISTS rollups (
+    name TEXT NOT NULL, period TEXT NOT NULL, start REAL NOT NULL,
+    count INTEGER NOT NULL, total REAL NOT NULL, low REAL NOT NULL, high REAL NOT NULL, last REAL NOT NULL,
+    PRIMARY KEY (name, period, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS series (name TEXT PRIMARY KEY, latest REAL NOT NULL);
+"""
+ROLLUP_UPSERT = """
+INSERT INTO rollups (name, period, start, count, total, low, high, last) VALUES (?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (name, period, start) DO UPDATE SET
+    count = count + 1, total = total + excluded.total,
+    low = min(low, excluded.low), high = max(high, excluded.high), last = excluded.last
+"""
+
+# Rollup periods, plus 'raw' for the samples themselves, and how many rows {+}{name@period} shows by default
+PERIODS = {'raw': 100, 'hour': 24, 'day': 30}
+STATS = {'mean': 'total / count', 'min': 'low', 'max': 'high', 'sum': 'total', 'count': 'count', 'last': 'last'}
+
+class VariableHistory:
+    """Every value the source scripts reported, kept in SQLite with hourly and daily rollups.
+
+    Samples are indexed on (name, time) for range queries. Numeric samples
+    are also folded into per-hour and per-day count/sum/min/max rows as
+    they arrive, so a chart reads a few dozen rollup rows instead of the
+    whole history. prune() drops rows older than the retention settings.
+    """
+
+    def __init__(self, path, retention=None):
+        self.path = path
+        self.retention = retention or {}  # 'raw', 'hour' or 'day' -> days to keep, 0 to keep forever
+        self._connection = None
+        self._pid = None
+        self._latest = None
+
+    def __getstate__(self):
+        # Block and render workers open their own connection
+        return {'path': self.path, 'retention': self.retention}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['retention'])
+
+    @property
+    def connection(self):
+        # A SQLite connection must not be used across a fork, so each process opens its own
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = connect(self.path)
+            self._pid = os.getpid()
+        return self._connection
+
+    def append(self, samples):
+        """Record (name, datetime string, data) samples, all in one transaction."""
+        with self.connection as db:
+            for name, when, data in samples:
+                time = parse_time(when).timestamp()
+                value = numeric(data)
+                db.execute('INSERT INTO samples (name, time, value, data) VALUES (?, ?, ?, ?)',
+                           (name, time, value, None if value is not None else json.dumps(data, default=str)))
+                db.execute('INSERT INTO series (name, latest) VALUES (?, ?) '
+                           'ON CONFLICT (name) DO UPDATE SET latest = max(latest, excluded.latest)', (name, time))
+                if value is None:
+                    continue  # Only numbers are rolled up
+                for period in ('hour', 'day'):
+                    db.execute(ROLLUP_UPSERT, (name, period, period_start(time, period), value, value, value, value))
+        self._latest = None
+
+    def series(self, name, period='hour', since=None, until=None, stat='mean', limit=None):
+        """[(datetime, value)] of one variable, oldest first.
+
+        period is 'hour' or 'day' for rollups (stat picks mean, min, max, sum,
+        count or last) or 'raw' for the samples as reported. since and until
+        are datetimes or ISO strings; limit keeps only the newest rows.
+        """
+        if period not in PERIODS:
+            raise ValueError(f"Unknown history period {period!r}, expected one of {', '.join(PERIODS)}")
+        if stat not in STATS:
+            raise ValueError(f"Unknown history stat {stat!r}, expected one of {', '.join(STATS)}")
+        since = parse_time(since).timestamp() if since is not None else float('-inf')
+        until = parse_time(until).timestamp() if until is not None else float('inf')
+        if period == 'raw':
+            query = ('SELECT time, value, data FROM samples WHERE name = ? AND time >= ? AND time < ? '
+                     'ORDER BY time DESC LIMIT ?')
+            parameters = (name, since, until, -1 if limit is None else limit)
+        else:
+            query = (f'SELECT start, {STATS[stat]}, NULL FROM rollups WHERE name = ? AND period = ? '
+                     'AND start >= ? AND start < ? ORDER BY start DESC LIMIT ?')
+            parameters = (name, period, since, until, -1 if limit is None else limit)
+        rows = self.connection.execute(query, parameters).fetchall()
+        return [(datetime.fromtimestamp(time), value if data is None else json.loads(data))
+                for time, value, data in reversed(rows)]
+
+    def render(self, spec):
+        """The text of a {+}{name@period} or {+}{name@period:count} placeholder: the series as JSON."""
+        name, _, period = spec.partition('@')
+        period, _, count = period.partition(':')
+        rows = self.series(name, period, limit=int(count) if count else PERIODS.get(period))
+        timespec = 'seconds' if period == 'raw' else 'minutes'
+        return json.dumps([[time.isoformat(timespec=timespec), value] for time, value in rows])
+
+    def hashes(self):
+        """name@history -> hash of each variable's newest sample, so outputs reading a series can be tracked."""
+        if self._latest is None:
+            self._latest = {f"{name}@history": hash_value(latest)
+                            for name, latest in self.connection.execute('SELECT name, latest FROM series')}
+        return self._latest
+
+    def prune(self, now=None):
+        """Drop samples and rollups older than their retention."""
+        now = (now or datetime.now()).timestamp()
+        names = [name for (name,) in self.connection.execute('SELECT name FROM series')]
+        with self.connection as db:
+            for period, days in self.retention.items():
+                if not days:
+                    continue
+                cutoff = now - float(days) * 86400
+                if period == 'raw':
+                    # Per name, so the (name, time) index does the work
+                    db.executemany('DELETE FROM samples WHERE name = ? AND time < ?', [(name, cutoff) for name in names])
+                else:
+                    db.execute('DELETE FROM rollups WHERE period = ? AND start < ?', (period, cutoff))
+
+    def close(self):
+        if self._connection is not None and self._pid == os.getpid():
+            self._connection.close()
+        self._connection = None
+
+def connect(path):
+    db = sqlite3.connect(path, timeout=30)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    if db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+        db.executescript(SCHEMA)
+        db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return db
+
+def parse_time(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+def numeric(data):
+    if isinstance(data, bool) or not isinstance(data, (int, float)):
+        return None
+    return float(data)
+
+def period_start(time, period):
+    # Buckets follow local time, so a day runs from local midnight
+    moment = datetime.fromtimestamp(time).replace(minute=0, second=0, microsecond=0)
+    if period == 'day':
+        moment = moment.replace(hour=0)
+    return moment.timestamp()
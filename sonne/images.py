@@ -1,25 +1,217 @@
 # images.py
 
-from PIL import Image, ImageOps, ImageEnhance
+# PIL is imported where images are decoded and encoded, so builds with no new image never load it
+import io
 import os
-import shutil
+import json
+import time
+import logging
+from sonne.manifest import hash_bytes, hash_value
+from sonne.assets import link_file
+from sonne.postprocess import write_if_changed
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever the encoder changes the bytes it writes; part of every cache key
+ENCODER_VERSION = 3
+
+# Quality steps tried, best first, until an encoding fits the byte budget
+QUALITY_STEPS = (80, 65, 50, 35)
+
+# Modes that keep every pixel exact and are encoded losslessly
+LOSSLESS_MODES = ('dither', 'palette')
+PALETTE_COLORS = 64
+
+# Formats variants can be written in
+IMAGE_FORMATS = ('avif', 'webp', 'png', 'jpeg')
 
 def optimize_images(base_dir, output_dir):
-    print("Optimizing images...")
+    logger.debug("Optimizing images...")
     # This function can be extended if needed.
 
-def dither_image(input_path, output_path):
-    # Open the image file
-    with Image.open(input_path) as img:
-        # Convert the image to grayscale
-        img = img.convert('L')
+def image_settings(config):
+    """Everything that affects the variants written for an image, from the config."""
+    mode = config.get_setting('DEFAULT', 'ImageMode')
+    if mode == 'dither' and str(config.get_setting('DEFAULT', 'DitherImages')).lower() in ('no', 'false'):
+        mode = 'quality'  # Older configs turn dithering off this way
+    formats = [name for name in config.get_setting('DEFAULT', 'ImageFormats') if name in IMAGE_FORMATS]
+    return {
+        'version': ENCODER_VERSION,
+        'mode': mode,
+        'widths': sorted(int(width) for width in config.get_setting('DEFAULT', 'ImageWidths')),
+        'formats': formats or ['png'],
+        'budget': int(config.get_setting('DEFAULT', 'ImageByteBudget')),
+    }
+
+def available_formats(formats):
+    # AVIF (and on some builds WebP) depend on how Pillow was compiled
+    from PIL import features
+    return [name for name in formats
+            if (name != 'avif' or features.check('avif')) and (name != 'webp' or features.check('webp'))] or ['png']
+
+def dither_image(img):
+    # Convert the image to grayscale, then to black and white with dithering
+    return img.convert('L').convert('1')
+
+def prepare_image(img, mode):
+    if mode == 'dither':
+        return dither_image(img)
+    if mode == 'palette':
+        from PIL import Image
+        return img.convert('RGB').quantize(PALETTE_COLORS, dither=Image.Dither.FLOYDSTEINBERG)
+    has_alpha = img.mode in ('RGBA', 'LA') or 'transparency' in img.info
+    return img.convert('RGBA' if has_alpha else 'RGB')
+
+def encode_image(img, name, quality):
+    """Bytes of img in the given format; quality None means lossless."""
+    buffer = io.BytesIO()
+    if name == 'png':
+        img.save(buffer, format='PNG', optimize=True)
+    elif name == 'webp':
+        if img.mode == '1':
+            img = img.convert('L')
+        if quality is None:
+            img.save(buffer, format='WEBP', lossless=True, quality=100, method=4)
+        else:
+            img.save(buffer, format='WEBP', quality=quality, method=4)
+    elif name == 'avif':
+        img.save(buffer, format='AVIF', quality=quality, speed=6)
+    elif name == 'jpeg':
+        img.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+def encoding_candidates(img, mode, formats):
+    """(quality, format, bytes) of every encoding worth trying, best quality first."""
+    candidates = []
+    if mode in LOSSLESS_MODES:
+        # AVIF and JPEG have no sensible lossless mode for 1-bit or palette images
+        candidates = [(None, name, encode_image(img, name, None)) for name in formats if name in ('png', 'webp')]
+    else:
+        for step, quality in enumerate(QUALITY_STEPS):
+            for name in formats:
+                if name == 'png':
+                    if step == 0:
+                        candidates.append((None, name, encode_image(img, name, None)))
+                elif name != 'jpeg' or img.mode == 'RGB':
+                    candidates.append((quality, name, encode_image(img, name, quality)))
+    # None of the configured formats suits this image (say AVIF only with dithering), so write a PNG as before
+    return candidates or [(None, 'png', encode_image(img, 'png', None))]
+
+def choose_encoding(candidates, budget):
+    """The smallest encoding at the best quality that fits the budget, or the smallest overall."""
+    for quality in dict.fromkeys(quality for quality, name, data in candidates):
+        fitting = [(len(data), name, data) for q, name, data in candidates if q == quality and len(data) <= budget]
+        if fitting:
+            size, name, data = min(fitting)
+            return name, data
+    size, name, data = min((len(data), name, data) for quality, name, data in candidates)
+    return name, data
+
+def variant_widths(width, widths):
+    # Never upscale: widths above the original collapse into the original width
+    if not widths:
+        return [width]
+    chosen = [w for w in widths if w < width]
+    top = min(width, widths[-1])
+    return chosen if top in chosen else chosen + [top]
+
+def encode_variants(source_path, cache_path, settings):
+    """Encode every width of an image into the cache and write its index; returns the index."""
+    from PIL import Image, ImageOps
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    base = os.path.splitext(cache_path)[0]
+    formats = available_formats(settings['formats'])
+    variants = []
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        for width in variant_widths(img.width, settings['widths']):
+            height = max(1, round(img.height * width / img.width))
+            # Resize first so dithering and palettes work at the size that is shown
+            resized = img.resize((width, height), Image.Resampling.LANCZOS) if width != img.width else img
+            prepared = prepare_image(resized, settings['mode'])
+            name, data = choose_encoding(encoding_candidates(prepared, settings['mode'], formats),
+                                         settings['budget'])
+            variant_path = f"{base}-{width}.{name}"
+            write_if_changed(variant_path, data)
+            variants.append({'width': width, 'height': height, 'format': name,
+                             'file': os.path.basename(variant_path), 'bytes': len(data)})
+    index = {'width': img.width, 'height': img.height, 'variants': variants}
+    write_if_changed(cache_path, json.dumps(index).encode('utf-8'))
+    return index
+
+class ImagePipeline:
+    """Encodes blog images into responsive variants through a content-addressed cache.
+
+    Every image gets one variant per configured width (never wider than the
+    original), each in whichever format is smallest at the best quality
+    that fits the byte budget. Cache entries are keyed on the source file's
+    hash and the image settings, so an image is encoded once no matter how
+    many posts or builds use it. variants() runs in the post conversion
+    workers; the parent links the results into the output with finish().
+    """
+
+    def __init__(self, cache_dir, settings):
+        self.cache_dir = os.path.join(cache_dir, 'images')
+        self.settings = settings
+        self.source_hashes = {}  # source path -> file hash, filled in by the parent
+        self.placements = {}     # output path -> file to link there
+        self.timings = {}        # source file name -> [seconds spent encoding, encodes], see pop_timings
+        self.indexes = {}        # cache path -> index already read this build, for images used more than once
+
+    def __getstate__(self):
+        # Workers only need to know where and how to encode
+        return {'cache_dir': self.cache_dir, 'settings': self.settings, 'source_hashes': self.source_hashes}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, placements={}, timings={}, indexes={})
+
+    def cache_path(self, source_path):
+        key = hash_value([self.source_hashes.get(source_path) or self._hash(source_path), self.settings])
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def variants(self, source_path):
+        """The cache index of an image, encoding it first if this is the first time it is seen.
+
+        Returns {'width', 'height', 'variants': [{'width', 'height', 'format', 'file', 'bytes'}, ...]},
+        with 'path' filled in as the cached file of each variant.
+        """
+        cache_path = self.cache_path(source_path)
+        if cache_path in self.indexes:
+            return self.indexes[cache_path]
+        index = None
+        if os.path.exists(cache_path):
+            with open(cache_path, 'r') as file:
+                index = json.load(file)
+            if not all(os.path.exists(os.path.join(os.path.dirname(cache_path), variant['file']))
+                       for variant in index['variants']):
+                index = None
+        if index is None:
+            start = time.perf_counter()
+            index = encode_variants(source_path, cache_path, self.settings)
+            timing = self.timings.setdefault(os.path.basename(source_path), [0.0, 0])
+            timing[0] += time.perf_counter() - start
+            timing[1] += 1
+        for variant in index['variants']:
+            variant['path'] = os.path.join(os.path.dirname(cache_path), variant['file'])
+        self.indexes[cache_path] = index
+        return index
+
+    def pop_timings(self):
+        # Sent back from the conversion workers with each post
+        timings, self.timings = self.timings, {}
+        return timings
 
-        # Apply dithering
-        img = img.convert('1')  # Convert to black and white with dithering
+    def add(self, output_path, input_path):
+        self.placements[output_path] = input_path
 
-        # Save the optimized image
-        img.save(output_path, optimize=True, format='PNG')  # Save as PNG to support black and white
+    def finish(self, encoded=0):
+        if encoded:
+            logger.info(f"Encoded {encoded} new images into the image cache.")
+        for output_path, input_path in self.placements.items():
+            link_file(input_path, output_path)
+        self.placements = {}
+        self.indexes = {}
 
-def copy_original_image(input_path, output_path):
-    # Copy the original image to the output directory
-    shutil.copy2(input_path, output_path)
+    def _hash(self, path):
+        with open(path, 'rb') as file:
+            return hash_bytes(file.read())
@@ -0,0 +1,176 @@
+# manifest.py
+
+import hashlib
+import json
+import logging
+import os
+
+MANIFEST_FILENAME = '.sonne_manifest.json'
+MANIFEST_VERSION = 3
+# Sonne's own files (manifests, caches, shard records) start with this; other dotfiles are content like any other
+PRIVATE_PREFIX = '.sonne'
+
+logger = logging.getLogger(__name__)
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_value(value):
+    # Stable hash for anything JSON can represent (front matter, variable data, ...)
+    return hash_bytes(json.dumps(value, sort_keys=True, default=str).encode('utf-8'))
+
+def hash_variables(variables, extra=None):
+    """Hash the data of every variable, plus '*' for outputs that can read any of them.
+
+    extra holds ready-made hashes of other things outputs can read, such as variable histories.
+    """
+    hashes = {name: hash_value(entry.get('data') if isinstance(entry, dict) else entry)
+              for name, entry in variables.items()}
+    hashes.update(extra or {})
+    hashes['*'] = hash_value(sorted(hashes.items()))
+    return hashes
+
+class BuildManifest:
+    """Persistent record of which inputs each output was built from.
+
+    Stored in the output directory so a rebuild can skip every output whose
+    inputs (source hashes, template hash, variables used) are unchanged.
+    """
+
+    def __init__(self, output_dir, config_hash='', force=False):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.config_hash = config_hash
+        self.force = force
+        self.files = {}    # absolute source path -> {'size', 'mtime', 'hash'}
+        self.outputs = {}  # output path relative to output_dir -> {'inputs': ..., 'rebuild': how to rebuild it}
+        self.posts = {}    # markdown path relative to the site -> cached parse result
+        self._seen_files = set()
+        self._seen_posts = set()
+        self.kept = set()  # outputs (relative to output_dir) this build produced or found fresh
+        self._disk_state = None  # size and mtime of the manifest file as last read or written
+        self.load()
+
+    def begin(self, force=False):
+        """Start another build with this manifest, as a long-running `sonne serve` does."""
+        if self._file_state() != self._disk_state:
+            # Someone else built the site in the meantime
+            self.files, self.outputs, self.posts = {}, {}, {}
+            self.load()
+        self.force = force
+        self._seen_files = set()
+        self._seen_posts = set()
+        self.kept = set()
+
+    def load(self):
+        self._disk_state = self._file_state()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable build manifest: {e}")
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.files = data.get('files', {})
+        self.outputs = data.get('outputs', {})
+        self.posts = data.get('posts', {})
+
+    def save(self, prune=True):
+        if prune:
+            # Forget sources that were not looked at this build (deleted posts, pages, images)
+            self.files = {path: entry for path, entry in self.files.items() if path in self._seen_files}
+            self.posts = {path: entry for path, entry in self.posts.items() if path in self._seen_posts}
+            self.outputs = {path: entry for path, entry in self.outputs.items() if path in self.kept}
+        if not os.path.exists(self.output_dir):
+            os.makedirs(self.output_dir)
+        with open(self.path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'version': MANIFEST_VERSION,
+                'files': self.files,
+                'outputs': self.outputs,
+                'posts': self.posts,
+            }, file)
+        self._disk_state = self._file_state()
+
+    def file_hash(self, path):
+        """SHA-256 of a file, re-read only when its size or mtime changed since the last build."""
+        path = os.path.abspath(path)
+        self._seen_files.add(path)
+        stat = os.stat(path)
+        entry = self.files.get(path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            return entry['hash']
+
+        self.files[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'hash': hash_file(path)}
+        return self.files[path]['hash']
+
+    def get_post(self, rel_path):
+        self._seen_posts.add(rel_path)
+        return None if self.force else self.posts.get(rel_path)
+
+    def set_post(self, rel_path, entry):
+        self._seen_posts.add(rel_path)
+        self.posts[rel_path] = entry
+
+    def is_fresh(self, output_path, inputs, variable_hashes):
+        """True when output_path exists and was built from exactly these inputs."""
+        recorded = self.outputs.get(self._rel(output_path))
+        if self.force or recorded is None or not os.path.exists(output_path):
+            return False
+
+        expected = dict(inputs, config=self.config_hash)
+        for key, digest in recorded['inputs'].items():
+            if key.startswith('var:'):
+                if variable_hashes.get(key[4:]) != digest:
+                    return False
+            elif expected.pop(key, None) != digest:
+                return False
+        if expected:
+            return False
+        self.keep(output_path)
+        return True
+
+    def record(self, output_path, inputs, variable_names, variable_hashes, rebuild=None):
+        """Remember what output_path was built from, and how to rebuild it when only variables change."""
+        entry = dict(inputs, config=self.config_hash)
+        for name in variable_names:
+            entry['var:' + name] = variable_hashes.get(name)
+        self.outputs[self._rel(output_path)] = {'inputs': entry, 'rebuild': rebuild}
+        self.keep(output_path)
+
+    def keep(self, output_path):
+        # Anything in the output directory not kept by a full build is stale, see prune_outputs
+        self.kept.add(self._rel(output_path))
+
+    def reads(self, name):
+        # Whether any output read the variable name
+        return any('var:' + name in recorded['inputs'] for recorded in self.outputs.values())
+
+    def variable_dependents(self, variable_hashes):
+        """(output path, rebuild info) of every output that read a variable whose value has since changed."""
+        stale = []
+        for rel_path, recorded in self.outputs.items():
+            if any(key.startswith('var:') and variable_hashes.get(key[4:]) != digest
+                   for key, digest in recorded['inputs'].items()):
+                stale.append((os.path.join(self.output_dir, rel_path), recorded['rebuild']))
+        return stale
+
+    def _file_state(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _rel(self, output_path):
+        return os.path.relpath(output_path, self.output_dir)
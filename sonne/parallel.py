@@ -0,0 +1,24 @@
+# parallel.py
+
+import os
+
+def default_jobs():
+    return os.cpu_count() or 1
+
+def run_parallel(function, tasks, jobs, initializer=None, initargs=()):
+    """Call function(*task) for every task, spread over up to `jobs` worker processes.
+
+    Results come back in task order. With one job (or one task) everything runs
+    in this process, so a serial build never pays for starting a pool.
+    """
+    tasks = list(tasks)
+    if jobs <= 1 or len(tasks) <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        return [function(*task) for task in tasks]
+
+    from concurrent.futures import ProcessPoolExecutor  # Serial builds never load multiprocessing
+    jobs = min(jobs, len(tasks))
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(function, *zip(*tasks), chunksize=chunksize))
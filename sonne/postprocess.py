@@ -0,0 +1,193 @@
+# postprocess.py
+
+import os
+import re
+import gzip
+import json
+import logging
+from sonne.manifest import PRIVATE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+# Optional compressors and minifiers; each is used only when installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+# Extensions of the outputs worth precompressing (images and fonts are already compressed)
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.json', '.svg', '.xml', '.txt', '.md')
+# Below this many bytes the compressed file is no smaller than the original
+MIN_COMPRESS_SIZE = 256
+# Which version of each output its siblings were compressed from
+PRECOMPRESS_FILENAME = '.sonne_precompress.json'
+
+# Elements whose whitespace is significant or that hold another language
+HTML_VERBATIM_PATTERN = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.IGNORECASE | re.DOTALL)
+HTML_COMMENT_PATTERN = re.compile(r'<!--(?!\[if|<!|>).*?-->', re.DOTALL)
+# Strings and unquoted url(...) are kept as written; comments are only matched outside them
+CSS_STRING_PATTERN = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|url\(\s*[^\s\'")][^)]*\))')
+CSS_COMMENT_PATTERN = re.compile(CSS_STRING_PATTERN.pattern + r'|/\*.*?\*/', re.DOTALL)
+
+def minify(content, extension):
+    """Minify HTML, CSS or JS output; anything else is returned unchanged."""
+    extension = extension.lower()
+    if extension == '.html':
+        return minify_html(content)
+    if extension == '.css':
+        return minify_css(content)
+    if extension == '.js' and rjsmin is not None:
+        return rjsmin.jsmin(content)
+    return content
+
+def can_minify(path):
+    extension = os.path.splitext(path)[1].lower()
+    return extension in ('.html', '.css') or (extension == '.js' and rjsmin is not None)
+
+def minify_html(content):
+    # Only line indentation, blank lines and comments go: collapsing whitespace
+    # between inline elements could change how the page renders
+    parts = HTML_VERBATIM_PATTERN.split(content)
+    minified = []
+    index = 0
+    while index < len(parts):
+        text = HTML_COMMENT_PATTERN.sub('', parts[index])
+        minified.append(re.sub(r'[ \t]*\n\s*', '\n', text))
+        if index + 1 < len(parts):
+            minified.append(parts[index + 1])  # A verbatim element, untouched
+        index += 3
+    return ''.join(minified).strip() + '\n'
+
+def minify_css(content):
+    if rcssmin is not None:
+        return rcssmin.cssmin(content)
+    content = CSS_COMMENT_PATTERN.sub(lambda match: match.group(1) or '', content)
+    parts = CSS_STRING_PATTERN.split(content)
+    # Every other part is a string literal or url(...), left untouched
+    return ''.join(part if index % 2 else squeeze_css(part) for index, part in enumerate(parts)).strip()
+
+def squeeze_css(content):
+    content = re.sub(r'\s+', ' ', content)
+    content = re.sub(r'\s*([{};,>])\s*', r'\1', content)
+    content = re.sub(r':\s+', ':', content)
+    return content.replace(';}', '}')
+
+def write_text_output(output_path, content, minify_output=False):
+    """Write an output page; returns False when the file already held exactly this content."""
+    if minify_output:
+        content = minify(content, os.path.splitext(output_path)[1])
+    return write_if_changed(output_path, content.encode('utf-8'))
+
+def write_if_changed(path, data):
+    """Atomically replace path with data, leaving it (and its mtime) alone when the bytes are the same.
+
+    Keeps rsync and other mtime-based sync tools from re-uploading unchanged outputs.
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as file:
+                if file.read() == data:
+                    return False
+    except OSError:
+        pass  # No output yet
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(data)
+    os.replace(temp_path, path)
+    return True
+
+def compressed_siblings(data):
+    """(extension, compressed bytes) for every encoding available here."""
+    siblings = [('.gz', gzip.compress(data, 9, mtime=0))]
+    if brotli is not None:
+        siblings.append(('.br', brotli.compress(data, quality=11)))
+    if zstandard is not None:
+        siblings.append(('.zst', zstandard.ZstdCompressor(level=19).compress(data)))
+    return siblings
+
+def sibling_extensions():
+    return ['.gz'] + (['.br'] if brotli is not None else []) + (['.zst'] if zstandard is not None else [])
+
+def precompress_outputs(output_dir):
+    """Write .gz (and .br/.zst when available) next to every text output, for gzip_static and friends.
+
+    The size, mtime and inode of every output are recorded when its siblings
+    are written, and siblings are left alone while those still match. Assets
+    keep their source's mtime, so an output can be replaced by one that looks
+    older; comparing mtimes would keep the old siblings. Prints a size report.
+    """
+    extensions = sibling_extensions()
+    state_path = os.path.join(output_dir, PRECOMPRESS_FILENAME)
+    try:
+        with open(state_path, 'r') as file:
+            previous = json.load(file)
+    except (OSError, ValueError):
+        previous = {}
+    state = {}
+    totals = {}
+    compressed_count = 0
+    for root, dirs, files in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(PRIVATE_PREFIX)]
+        for file in files:
+            path = os.path.join(root, file)
+            base, extension = os.path.splitext(path)
+            if extension in ('.gz', '.br', '.zst'):
+                # Remove siblings whose output no longer exists
+                if not os.path.exists(base):
+                    os.remove(path)
+                continue
+            if file.startswith(PRIVATE_PREFIX) or extension.lower() not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            output_stat = os.stat(path)
+            sizes = totals.setdefault(extension.lower(), {'files': 0, 'raw': 0})
+            sizes['files'] += 1
+            sizes['raw'] += output_stat.st_size
+            if output_stat.st_size < MIN_COMPRESS_SIZE:
+                # Served as is, so count it at its raw size
+                for ext in extensions:
+                    sizes[ext] = sizes.get(ext, 0) + output_stat.st_size
+                    if os.path.exists(path + ext):
+                        os.remove(path + ext)
+                continue
+
+            rel_path = os.path.relpath(path, output_dir)
+            state[rel_path] = [output_stat.st_size, output_stat.st_mtime_ns, output_stat.st_ino]
+            if previous.get(rel_path) != state[rel_path] or not all(os.path.exists(path + ext) for ext in extensions):
+                with open(path, 'rb') as source:
+                    data = source.read()
+                for ext, compressed in compressed_siblings(data):
+                    write_if_changed(path + ext, compressed)
+                compressed_count += 1
+
+            for ext in extensions:
+                sizes[ext] = sizes.get(ext, 0) + os.path.getsize(path + ext)
+
+    write_if_changed(state_path, json.dumps(state, sort_keys=True).encode('utf-8'))
+    log_size_report(totals, extensions, compressed_count)
+    return totals
+
+def log_size_report(totals, extensions, compressed_count):
+    if not totals:
+        return
+    logger.info(f"Precompressed {compressed_count} outputs. Output sizes:")
+    for extension, sizes in sorted(totals.items()):
+        encoded = ', '.join(f"{ext[1:]} {format_size(sizes[ext])}" for ext in extensions)
+        logger.info(f"\t{extension:6} {sizes['files']:5} files  {format_size(sizes['raw'])} raw, {encoded}")
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024 or unit == 'MB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
@@ -0,0 +1,234 @@
+# search.py
+
+import os
+import re
+import html
+import json
+import logging
+from sonne.manifest import hash_value
+from sonne.postprocess import write_if_changed
+
+logger = logging.getLogger(__name__)
+
+# Bumped whenever tokenizing changes, so the cached postings are rebuilt
+SEARCH_VERSION = 1
+SEARCH_DIRECTORY = 'search'
+STATE_FILENAME = 'search.json'
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+MARKUP_PATTERN = re.compile(r'<(script|style)\b.*?</\1\s*>|<[^>]*>', re.IGNORECASE | re.DOTALL)
+PLACEHOLDER_PATTERN = re.compile(r'\{p\}\{#[\s\S]*?#\}|\{[+-]\}\{.*?\}')
+# A match in the title counts for more than one in the body
+FIELD_WEIGHTS = {'title': 4, 'tags': 3, 'description': 2, 'body': 1}
+STOPWORDS = frozenset(
+    'an and are as at be but by for from has have in is it its of on or that the this to was were will with'.split())
+
+def tokenize(text):
+    """Lowercased words of text, without one-letter words and stopwords. search.js splits queries the same way."""
+    return [word for word in WORD_PATTERN.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+def body_text(body):
+    # The text a reader sees: no tags, scripts or Sonne placeholders
+    return html.unescape(MARKUP_PATTERN.sub(' ', PLACEHOLDER_PATTERN.sub(' ', body)))
+
+def post_terms(post, body):
+    """term -> weight of one post, summed over its title, tags, description and body."""
+    fields = {'title': post.get('title', ''), 'tags': ' '.join(post.get('tags') or []),
+              'description': post.get('description', ''), 'body': body_text(body)}
+    terms = {}
+    for field, text in fields.items():
+        for word in tokenize(text):
+            terms[word] = terms.get(word, 0) + FIELD_WEIGHTS[field]
+    return terms
+
+def free_id(used):
+    # Ids are reused, so deleting a post does not renumber (and rewrite) every shard
+    number = next(number for number in range(len(used) + 1) if number not in used)
+    used.add(number)
+    return number
+
+def shard_name(prefix):
+    # Prefixes outside a-z and 0-9 are spelled out in hex, so every shard has a plain file name
+    if re.fullmatch(r'[a-z0-9]+', prefix):
+        return prefix
+    return '_' + prefix.encode('utf-8').hex()
+
+class SearchIndex:
+    """An inverted index of the blog posts, written to the output as JSON shards for search.js.
+
+    Terms are sharded by their first few characters (SearchPrefixLength),
+    so a query fetches one small file per word. The postings of every post
+    are cached along with a key of its title, tags, description and body;
+    a build re-tokenizes only posts whose key changed and rewrites only the
+    shards holding their old or new terms.
+    """
+
+    def __init__(self, cache_dir, prefix_length=2):
+        self.path = os.path.join(cache_dir, STATE_FILENAME)
+        self.prefix_length = max(1, int(prefix_length))
+        self.docs = {}      # full_url -> {'id', 'key', 'title', 'date', 'terms'}
+        self.postings = {}  # term -> {doc id: weight}
+        self.stale = True   # every shard needs writing, as after a prefix change or with no cache
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        if state.get('version') != SEARCH_VERSION:
+            return
+        self.docs = state['docs']
+        self.stale = state['prefix_length'] != self.prefix_length
+        for doc in self.docs.values():
+            for term, weight in doc['terms'].items():
+                self.postings.setdefault(term, {})[doc['id']] = weight
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        state = {'version': SEARCH_VERSION, 'prefix_length': self.prefix_length, 'docs': self.docs}
+        write_if_changed(self.path, json.dumps(state, separators=(',', ':')).encode('utf-8'))
+
+    def prefix(self, term):
+        return term[:self.prefix_length]
+
+    def update(self, posts, content, output_dir, manifest):
+        """Bring the index up to date with posts (all_blog_posts) and write what changed to output_dir."""
+        touched = set()  # prefixes whose shard changed
+        current = {post['full_url'] for post in posts}
+        for url in [url for url in self.docs if url not in current]:
+            touched |= self._remove(url)
+
+        used_ids = {doc['id'] for doc in self.docs.values()}
+        indexed = 0
+        for post in posts:
+            key = hash_value([post['title'], post.get('tags'), post.get('description'), post['content_hash']])
+            doc = self.docs.get(post['full_url'])
+            if doc is not None and doc['key'] == key:
+                continue
+            # An edited post keeps its id
+            doc_id = free_id(used_ids) if doc is None else doc['id']
+            if doc is not None:
+                touched |= self._remove(post['full_url'])
+            doc = {'id': doc_id, 'key': key, 'title': post['title'], 'date': post.get('date_posted', ''),
+                   'terms': post_terms(post, content.read(post))}
+            self.docs[post['full_url']] = doc
+            for term, weight in doc['terms'].items():
+                self.postings.setdefault(term, {})[doc['id']] = weight
+            touched |= {self.prefix(term) for term in doc['terms']}
+            indexed += 1
+
+        search_dir = os.path.join(output_dir, SEARCH_DIRECTORY)
+        os.makedirs(search_dir, exist_ok=True)
+        shards = {}
+        for term in self.postings:
+            shards.setdefault(self.prefix(term), []).append(term)
+
+        written = 0
+        for prefix, terms in shards.items():
+            path = os.path.join(search_dir, shard_name(prefix) + '.json')
+            if self.stale or prefix in touched or not os.path.exists(path):
+                written += write_if_changed(path, self._shard(terms))
+            manifest.keep(path)
+
+        for filename, data in (('index.json', self._meta(shards)), ('search.js', SEARCH_JS.encode('utf-8'))):
+            path = os.path.join(search_dir, filename)
+            write_if_changed(path, data)
+            manifest.keep(path)
+
+        self.stale = False
+        self.save()
+        logger.info(f"Indexed {indexed} changed posts for search, rewrote {written} of {len(shards)} shards.")
+
+    def _remove(self, url):
+        # Drops a post's postings; returns the prefixes it appeared under
+        doc = self.docs.pop(url)
+        for term in doc['terms']:
+            postings = self.postings[term]
+            postings.pop(doc['id'], None)
+            if not postings:
+                del self.postings[term]
+        return {self.prefix(term) for term in doc['terms']}
+
+    def _shard(self, terms):
+        # term -> flat [id, weight, id, weight, ...], ids ascending
+        shard = {term: [value for doc_id, weight in sorted(self.postings[term].items()) for value in (doc_id, weight)]
+                 for term in sorted(terms)}
+        return json.dumps(shard, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def _meta(self, shards):
+        # What search.js loads first: the posts by id and which shards exist
+        docs = [None] * (max((doc['id'] for doc in self.docs.values()), default=-1) + 1)
+        for url, doc in self.docs.items():
+            docs[doc['id']] = [url, doc['title'], doc['date']]
+        meta = {
+            'version': SEARCH_VERSION,
+            'prefix_length': self.prefix_length,
+            'stopwords': sorted(STOPWORDS),
+            'shards': sorted(shard_name(prefix) for prefix in shards),
+            'docs': docs,
+        }
+        return json.dumps(meta, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+# Loaded by pages with <script src="/search/search.js">; finds the index next to itself
+SEARCH_JS = r"""// search.js, written by Sonne: sonneSearch(query) resolves to [{url, title, date, score}], best match first.
+// url is relative to the site root, as in all_blog_posts.
+(function () {
+  var base = document.currentScript ? document.currentScript.src.replace(/[^\/]*$/, '') : '/search/';
+  var meta = null, shards = {};
+
+  function load(name) {
+    return fetch(base + name).then(function (response) { return response.json(); });
+  }
+  function shardName(prefix) {
+    if (/^[a-z0-9]+$/.test(prefix)) return prefix;
+    return '_' + Array.from(new TextEncoder().encode(prefix), function (b) {
+      return b.toString(16).padStart(2, '0');
+    }).join('');
+  }
+  function tokenize(text) {
+    return (text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []).filter(function (word) {
+      return Array.from(word).length > 1 && meta.stopwords.indexOf(word) < 0;
+    });
+  }
+  function shard(word) {
+    var name = shardName(Array.from(word).slice(0, meta.prefix_length).join(''));
+    if (meta.shards.indexOf(name) < 0) return Promise.resolve({});
+    if (!shards[name]) shards[name] = load(name + '.json');
+    return shards[name];
+  }
+
+  window.sonneSearch = function (query, limit) {
+    return (meta ? Promise.resolve(meta) : load('index.json').then(function (m) { return meta = m; }))
+      .then(function () {
+        var words = tokenize(query).filter(function (w, i, all) { return all.indexOf(w) === i; });
+        return Promise.all(words.map(shard)).then(function (loaded) {
+          var scores = null;
+          words.forEach(function (word, i) {
+            // The last word may still be being typed, so it matches as a prefix
+            var last = i === words.length - 1 && Array.from(word).length >= meta.prefix_length;
+            var found = {};
+            Object.keys(loaded[i]).forEach(function (term) {
+              if (term !== word && !(last && term.indexOf(word) === 0)) return;
+              var postings = loaded[i][term];
+              for (var j = 0; j < postings.length; j += 2) {
+                found[postings[j]] = (found[postings[j]] || 0) + postings[j + 1];
+              }
+            });
+            // Every word has to match
+            var next = {};
+            Object.keys(found).forEach(function (id) {
+              if (scores === null || id in scores) next[id] = (scores ? scores[id] : 0) + found[id];
+            });
+            scores = next;
+          });
+          return Object.keys(scores || {})
+            .map(function (id) { return {url: meta.docs[id][0], title: meta.docs[id][1], date: meta.docs[id][2], score: scores[id]}; })
+            .sort(function (a, b) { return b.score - a.score; })
+            .slice(0, limit || 20);
+        });
+      });
+  };
+})();
+"""
@@ -0,0 +1,202 @@
+# serve.py
+
+import os
+import sys
+import json
+import time
+import errno
+import signal
+import socket
+import select
+import logging
+from datetime import datetime
+from sonne.generator import SiteState, generate_site, refresh_site, history_files
+from sonne.watch import create_watcher, ignored_path
+
+SOCKET_FILENAME = 'serve.sock'
+# Changes arriving this close together are built as one
+DEBOUNCE_SECONDS = 0.2
+MAX_REQUEST_BYTES = 1 << 16
+
+logger = logging.getLogger(__name__)
+
+def socket_path(base_dir, config):
+    return os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'), SOCKET_FILENAME)
+
+class LogCapture(logging.Handler):
+    # Collects what a build logs, to send back to the client that asked for it
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+class SiteServer:
+    """A long-running `sonne serve`: builds from a warm SiteState on file changes and on request.
+
+    Requests come in over a Unix socket as one JSON line, such as
+    {"command": "build", "force": false}, and get one JSON line back.
+    Commands are build, refresh, status and stop.
+    """
+
+    def __init__(self, base_dir, path=None, jobs=None, polling=False, poll_interval=1.0):
+        self.base_dir = os.path.abspath(base_dir)
+        self.jobs = jobs
+        self.poll_interval = poll_interval
+        self.state = SiteState(self.base_dir)
+        self.path = path or socket_path(self.base_dir, self.state.config)
+        self.config_path = os.path.join(self.base_dir, 'sonne.config')
+        self.started = time.time()
+        self.builds = 0
+        self.last_build = None
+        self.running = False
+        self.watcher = create_watcher(self.base_dir, self.ignore, polling)
+        self.server = None
+
+    def ignore(self, path):
+        config = self.state.config
+        excluded = [os.path.join(self.base_dir, config.get_setting('DEFAULT', name))
+                    for name in ('OutputDirectory', 'CacheDirectory', 'VariablesFile')]
+        history_dir = os.path.dirname(os.path.join(self.base_dir, config.get_setting('DEFAULT', 'HistoryFile')))
+        excluded += [os.path.join(history_dir, name) for name in history_files(config)]
+        return ignored_path(path, excluded)
+
+    def serve_forever(self):
+        self.server = listen(self.path)
+        self.running = True
+        logger.info(f"Serving {self.base_dir} on {self.path} "
+                    f"({'polling' if self.watcher.fileno() is None else 'inotify'})")
+        self.build('build')
+        try:
+            while self.running:
+                readers = [self.server] + ([self.watcher] if self.watcher.fileno() is not None else [])
+                timeout = self.poll_interval if self.watcher.fileno() is None else None
+                ready, _, _ = select.select(readers, [], [], timeout)
+                if self.watcher in ready or self.watcher.fileno() is None:
+                    self.handle_changes(self.watcher.changes())
+                if self.server in ready:
+                    self.handle_connection()
+        finally:
+            self.close()
+
+    def handle_changes(self, changed):
+        if not changed:
+            return
+        # Let an editor or a git checkout finish writing before building
+        time.sleep(DEBOUNCE_SECONDS)
+        changed |= self.watcher.changes()
+        logger.info(f"{len(changed)} files changed, rebuilding")
+        if self.config_path in changed:
+            self.reload()
+        self.build('build')
+
+    def handle_connection(self):
+        connection, _ = self.server.accept()
+        with connection:
+            try:
+                request = json.loads(read_line(connection, MAX_REQUEST_BYTES))
+                response = self.handle_request(request)
+            except (OSError, ValueError) as e:
+                response = {'ok': False, 'error': f"bad request: {e}"}
+            try:
+                connection.sendall(json.dumps(response).encode('utf-8') + b'\n')
+            except OSError:
+                pass  # The client gave up waiting
+
+    def handle_request(self, request):
+        command = request.get('command')
+        if command in ('build', 'refresh'):
+            return self.build(command, bool(request.get('force')))
+        if command == 'status':
+            return {'ok': True, 'pid': os.getpid(), 'site': self.base_dir, 'uptime': time.time() - self.started,
+                    'builds': self.builds, 'last_build': self.last_build,
+                    'watching': 'polling' if self.watcher.fileno() is None else 'inotify'}
+        if command == 'stop':
+            self.running = False
+            return {'ok': True}
+        return {'ok': False, 'error': f"unknown command {command!r}"}
+
+    def build(self, command, force=False):
+        """Run a build or refresh on the warm state; returns the response for the client."""
+        capture = LogCapture()
+        logging.getLogger().addHandler(capture)
+        try:
+            if command == 'refresh':
+                stats = refresh_site(self.base_dir, state=self.state)
+            else:
+                stats = generate_site(self.base_dir, force=force, jobs=self.jobs, state=self.state)
+        except Exception as e:
+            logger.exception(f"{command.capitalize()} failed")
+            # Whatever the state holds may be half updated; start the next build from disk
+            self.reload()
+            return {'ok': False, 'error': str(e), 'log': capture.records}
+        finally:
+            logging.getLogger().removeHandler(capture)
+        self.builds += 1
+        self.last_build = datetime.now().isoformat(timespec='seconds')
+        return {'ok': True, 'stats': stats.to_dict(slowest=20), 'log': capture.records}
+
+    def reload(self):
+        self.state.close()
+        self.state = SiteState(self.base_dir)
+
+    def close(self):
+        self.state.close()
+        self.watcher.close()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+def listen(path):
+    """A Unix socket listening at path, replacing a stale socket file left by a daemon that died."""
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    os.chmod(path, 0o600)  # Builds run the site's Python, so only its owner may ask for one
+    server.listen(8)
+    return server
+
+def read_line(connection, limit=None):
+    data = b''
+    while not data.endswith(b'\n'):
+        chunk = connection.recv(4096)
+        if not chunk:
+            break
+        data += chunk
+        if limit is not None and len(data) > limit:
+            raise ValueError("request too long")
+    return data.decode('utf-8')
+
+def send(path, request, timeout=None):
+    """Send one request to a running daemon; returns its response, or None when no daemon is listening."""
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(timeout)
+    try:
+        client.connect(path)
+    except OSError as e:
+        client.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            return None
+        raise
+    with client:
+        client.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        return json.loads(read_line(client))
+
+def serve(base_dir, path=None, jobs=None, polling=False, poll_interval=1.0):
+    server = SiteServer(base_dir, path, jobs, polling, poll_interval)
+    if send(server.path, {'command': 'status'}) is not None:
+        server.close()
+        logger.error(f"A sonne daemon is already listening on {server.path}")
+        sys.exit(1)
+    # Let `kill` shut the daemon down cleanly, removing its socket and stopping block workers
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logger.info("Stopped serving.")
@@ -1,29 +1,38 @@
 import os
+import logging
 from sonne.config import Config
 
+logger = logging.getLogger(__name__)
+
 def setup(base_dir):
-    initialize_sonne(base_dir)
+    """Check the site directory and its config, creating what is missing; returns the site's Config."""
+    return initialize_sonne(base_dir)
 
 def initialize_sonne(base_dir):
-    print("Initializing Sonne")
+    logger.info("Initializing Sonne")
     # Ensure base_dir exists
-    if not os.path.exists(base_dir):
-        os.makedirs(base_dir)
-        print("\tCreating base directory...")
+    if ensure_directory(base_dir):
+        logger.info("\tCreating base directory...")
 
     config = Config(os.path.join(base_dir, 'sonne.config'))
 
-    # Ensure directories as specified in the configuration
-    ensure_directory(os.path.join(base_dir, config.get_setting('DEFAULT', 'OutputDirectory')))
-    ensure_directory(os.path.join(base_dir, config.get_setting('DEFAULT', 'BlogDirectory')))
-    ensure_directory(os.path.join(base_dir, config.get_setting('DEFAULT', 'PagesDirectory')))
-    ensure_directory(os.path.join(base_dir, config.get_setting('DEFAULT', 'SourceDirectory')))
-    ensure_directory(os.path.join(base_dir, config.get_setting('DEFAULT', 'OutputDirectory'), config.get_setting('DEFAULT', 'BlogDirectory')))
-
+    # Ensure directories as specified in the configuration, in one pass over the existing ones
+    existing = {entry.name for entry in os.scandir(base_dir) if entry.is_dir()}
+    output_dir = config.get_setting('DEFAULT', 'OutputDirectory')
+    for name in ('OutputDirectory', 'BlogDirectory', 'PagesDirectory', 'SourceDirectory'):
+        directory = config.get_setting('DEFAULT', name)
+        if directory not in existing and ensure_directory(os.path.join(base_dir, directory)):
+            logger.info(f"\tCreating {os.path.basename(directory)} directory...")
+    if ensure_directory(os.path.join(base_dir, output_dir, config.get_setting('DEFAULT', 'BlogDirectory'))):
+        logger.info(f"\tCreating {config.get_setting('DEFAULT', 'BlogDirectory')} directory...")
 
-    print(f"Sonne configuration verified in `{base_dir}`.")
+    logger.info(f"Sonne configuration verified in `{base_dir}`.")
+    return config
 
 def ensure_directory(path):
-    if not os.path.exists(path):
+    # True when the directory had to be created
+    try:
         os.makedirs(path)
-        print(f"\tCreating {os.path.basename(path)} directory...")
+    except FileExistsError:
+        return False
+    return True
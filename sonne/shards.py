@@ -0,0 +1,168 @@
+# shards.py
+
+import os
+import re
+import json
+import filecmp
+import logging
+from datetime import datetime
+from sonne.manifest import BuildManifest, hash_bytes
+from sonne.content_store import ContentStore
+from sonne.assets import copy_asset
+from sonne.deploy import output_files
+from sonne.postprocess import write_if_changed
+
+SHARD_FILENAME = '.sonne_shard.json'
+SHARD_VERSION = 1
+# Post bodies of a shard live in its own tree, so the tree is all `sonne merge` needs from another machine
+CONTENT_DIRECTORY = '.sonne_content'
+
+logger = logging.getLogger(__name__)
+
+class MergeError(Exception):
+    """Shard builds that cannot be merged: some are missing, disagree on the config or wrote the same file."""
+
+def parse_shard(text):
+    """(i, N) from 'i/N', with shards numbered from 1."""
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"expected i/N with 1 <= i <= N, got {text!r}")
+    return int(match.group(1)), int(match.group(2))
+
+def in_shard(rel_path, shard):
+    """Whether the source at rel_path (relative to the site) belongs to shard, or True for a whole-site build.
+
+    Decided by a hash of the path, so every machine splits the site the same
+    way whatever order its filesystem lists files in.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hash_bytes(rel_path.replace(os.sep, '/').encode('utf-8'))[:8], 16) % count == index - 1
+
+def shards_directory(base_dir, config):
+    return os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'), 'shards')
+
+def shard_directory(base_dir, config, shard):
+    return os.path.join(shards_directory(base_dir, config), f"{shard[0]}-of-{shard[1]}")
+
+def write_shard_record(output_dir, shard, base_dir, config_hash, blog_posts):
+    # What the merge needs besides the files: the shard's posts, and where and with which config it was built
+    record = {
+        'version': SHARD_VERSION,
+        'shard': list(shard),
+        'base_dir': os.path.abspath(base_dir),
+        'config': config_hash,
+        'built': datetime.now().isoformat(),
+        'posts': [[post, front_matter, rel_path] for post, front_matter, rel_path in blog_posts],
+    }
+    write_if_changed(os.path.join(output_dir, SHARD_FILENAME), json.dumps(record, default=str).encode('utf-8'))
+    logger.info(f"Built shard {shard[0]}/{shard[1]} with {len(blog_posts)} posts into {output_dir}")
+
+def find_shards(base_dir, config, config_hash):
+    """[(shard directory, record)] of the newest set of shard builds, in shard order.
+
+    Raises MergeError when a shard of the set is missing or was built with another sonne.config.
+    """
+    directory = shards_directory(base_dir, config)
+    records = {}
+    for name in sorted(os.listdir(directory)) if os.path.isdir(directory) else []:
+        path = os.path.join(directory, name, SHARD_FILENAME)
+        if not re.fullmatch(r'\d+-of-\d+', name) or not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as file:
+            record = json.load(file)
+        if record.get('version') == SHARD_VERSION:
+            records[tuple(record['shard'])] = (os.path.join(directory, name), record)
+    if not records:
+        raise MergeError(f"No shard builds in {directory}, run sonne --shard i/N first")
+
+    # Older builds split another way may still be lying around
+    count = max(records.items(), key=lambda item: item[1][1]['built'])[0][1]
+    missing = [f"{index}/{count}" for index in range(1, count + 1) if (index, count) not in records]
+    if missing:
+        raise MergeError(f"Shards {', '.join(missing)} have not been built")
+    shards = [records[(index, count)] for index in range(1, count + 1)]
+    for shard_dir, record in shards:
+        if record['config'] != config_hash:
+            raise MergeError(f"Shard {record['shard'][0]}/{count} was built with a different sonne.config")
+    return shards
+
+def collect_outputs(shards):
+    """Output path (relative) -> the shard directory it is taken from, for every file the shards wrote.
+
+    Two shards may write the same file only with the same bytes, as they do
+    for an image used by posts in both; anything else is a MergeError.
+    """
+    owners = {}
+    collisions = []
+    for shard_dir, record in shards:
+        for rel_path in output_files(shard_dir):
+            other = owners.setdefault(rel_path, shard_dir)
+            if other != shard_dir and not filecmp.cmp(os.path.join(other, rel_path), os.path.join(shard_dir, rel_path),
+                                                      shallow=False):
+                collisions.append(f"{rel_path} (shards {os.path.basename(other)} and {os.path.basename(shard_dir)})")
+    if collisions:
+        raise MergeError(f"{len(collisions)} outputs were written differently by two shards: " + ', '.join(collisions[:10]))
+    return owners
+
+def merge_posts(shards, content):
+    """Every shard's posts as (metadata, front matter, markdown path), with their bodies copied into content."""
+    blog_posts = []
+    for shard_dir, record in shards:
+        bodies = ContentStore(os.path.join(shard_dir, CONTENT_DIRECTORY))
+        for post, front_matter, rel_path in record['posts']:
+            if not content.has(post['content_hash']):
+                content.put(bodies.read(post['content_hash']))
+            blog_posts.append((post, front_matter, rel_path))
+    return blog_posts
+
+def check_posts(blog_posts, blog_directory, owners):
+    # Two posts with the same date and page_url, or a shard file where a post goes, would silently overwrite each other
+    seen = {}
+    collisions = []
+    for post, front_matter, rel_path in blog_posts:
+        output = os.path.join(blog_directory, post['date_posted'] + '-' + post['page_url'] + '.html')
+        if output in seen:
+            collisions.append(f"{output} ({seen[output]} and {rel_path})")
+        elif output in owners:
+            collisions.append(f"{output} ({rel_path} and a file of shard {os.path.basename(owners[output])})")
+        seen[output] = rel_path
+    if collisions:
+        raise MergeError(f"{len(collisions)} posts would overwrite other outputs: " + ', '.join(collisions[:10]))
+
+def merge_manifests(shards, owners, base_dir, output_dir, manifest):
+    """Take over what each shard's manifest knows about its outputs and posts, with paths moved to this site."""
+    for shard_dir, record in shards:
+        shard_manifest = BuildManifest(shard_dir)
+        for rel_path, entry in shard_manifest.outputs.items():
+            if owners.get(rel_path) != shard_dir:
+                continue
+            rebuild = entry['rebuild']
+            if rebuild and 'source' in rebuild:
+                rebuild = dict(rebuild, source=rebase(rebuild['source'], record['base_dir'], base_dir))
+            manifest.outputs[rel_path] = dict(entry, rebuild=rebuild)
+        for rel_path, entry in shard_manifest.posts.items():
+            # So a later whole-site build or refresh can reuse the shards' work
+            manifest.set_post(rel_path, dict(
+                entry,
+                images=[rebase(path, shard_dir, output_dir) for path in entry['images']],
+                image_sources=[rebase(path, record['base_dir'], base_dir) for path in entry['image_sources']]))
+
+def copy_outputs(owners, output_dir, manifest, link=True, skip=()):
+    """Copy (or hardlink) every shard output into output_dir, except those in skip; returns how many changed."""
+    copied = 0
+    for rel_path, shard_dir in owners.items():
+        output_path = os.path.join(output_dir, rel_path)
+        manifest.keep(output_path)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        if rel_path in skip:
+            continue
+        copied += copy_asset(os.path.join(shard_dir, rel_path), output_path, link)
+    return copied
+
+def rebase(path, old_root, new_root):
+    # A path under old_root moved to the same place under new_root; other paths are left alone
+    if path == old_root or path.startswith(old_root + os.sep):
+        return os.path.join(new_root, os.path.relpath(path, old_root))
+    return path
@@ -0,0 +1,224 @@
+# sources.py
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import hashlib
+import subprocess
+import importlib.util
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+STATE_FILENAME = 'sources.json'
+
+logger = logging.getLogger(__name__)
+
+# Scripts can declare their own settings in a comment, e.g. `# sonne: ttl=300 timeout=20`
+DECLARATION_PATTERN = re.compile(r'^#\s*sonne:(.*)$', re.MULTILINE)
+
+def run_sources(source_dir, config, store, cache_dir, jobs=1, stats=None):
+    """Run every sonne_sources script concurrently, each in its own Python process.
+
+    A script whose variables are younger than its TTL is not run at all, and a
+    script that fails or times out keeps the values (and datetimes) it reported
+    last time. pip only runs when requirements.txt changed since it last succeeded.
+
+    Returns when the first script will be due again, as a timestamp (now for
+    a script without a TTL or one that failed), or None with no scripts.
+    """
+    state_path = os.path.join(cache_dir, STATE_FILENAME)
+    state = load_state(state_path)
+    if not os.path.exists(source_dir):
+        return None
+
+    install_requirements(source_dir, state)
+
+    previous = PreviousVariables(store)
+    before = dict(store.variables)
+    settings = config.get_setting('DEFAULT', 'SourceScripts') or {}
+    default_timeout = config.get_setting('DEFAULT', 'SourceTimeout')
+    now = datetime.now()
+    due = []  # when each script has to run again
+
+    scripts = []
+    for filename in sorted(os.listdir(source_dir)):
+        if not filename.endswith('.py') or filename.startswith('__'):
+            continue
+        file_path = os.path.join(source_dir, filename)
+        with open(file_path, 'rb') as file:
+            script = file.read()
+        options = dict(read_declarations(script.decode('utf-8', errors='replace')), **settings.get(filename, {}))
+        script_state = state['scripts'].get(filename, {})
+        script_hash = hashlib.sha256(script).hexdigest()
+
+        age = previous.age(script_state.get('variables', []), now)
+        if script_state.get('hash') == script_hash and age is not None and age < float(options.get('ttl', 0)):
+            logger.info(f"Skipped {filename}, its variables are {int(age)}s old")
+            previous.restore(script_state['variables'])
+            due.append(now.timestamp() + float(options['ttl']) - age)
+            continue
+        scripts.append((filename, file_path, script_hash, float(options.get('timeout', default_timeout))))
+        # Counted from before the script runs, so never later than its variables actually expire
+        due.append(now.timestamp() + float(options.get('ttl', 0)))
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        outcomes = list(executor.map(lambda script: run_script(script[1], script[3]), scripts))
+
+    # Merge in script order so a later script still overrides an earlier one
+    samples = []
+    for (filename, file_path, script_hash, timeout), (reported, error, seconds) in zip(scripts, outcomes):
+        if stats is not None:
+            stats.record('script', filename, seconds)
+        if error is None:
+            for key, entry in reported.items():
+                store.variables[key] = entry
+                samples.append((key, entry['datetime'], entry['data']))
+            state['scripts'][filename] = {'hash': script_hash, 'variables': sorted(reported)}
+            logger.info(f"Ran {filename} in {seconds:.2f}s")
+        else:
+            names = state['scripts'].get(filename, {}).get('variables', [])
+            restored = previous.restore(names)
+            logger.warning(f"{filename} failed ({error}); keeping {len(restored)} stale variables from the last run")
+            due.append(now.timestamp())  # Try again next time
+
+    if store.history is not None and samples:
+        store.history.append(samples)
+    if store.variables != before:
+        # Only when a script reported something or a stale value went back in
+        store.mark_changed()
+    save_state(state_path, state)
+    return min(due, default=None)
+
+def run_script(file_path, timeout):
+    """Run one script in a child process; returns (reported variables, error or None, seconds taken).
+
+    What the script prints is logged at debug level, or as a warning when it fails.
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        result_path = os.path.join(temp_dir, 'result.json')
+        env = dict(os.environ)
+        # Make sure the child can import sonne even when it is not installed
+        package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_root, env.get('PYTHONPATH')]))
+        name = os.path.basename(file_path)
+        start = time.perf_counter()
+        try:
+            completed = subprocess.run([sys.executable, '-m', 'sonne.sources', file_path, result_path],
+                                       env=env, timeout=timeout, capture_output=True, text=True)
+        except subprocess.TimeoutExpired:
+            return {}, f"timed out after {timeout:g}s", time.perf_counter() - start
+        seconds = time.perf_counter() - start
+        for line in completed.stdout.splitlines():
+            logger.debug(f"{name}: {line}")
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            for line in completed.stderr.splitlines():
+                logger.warning(f"{name}: {line}")
+            return {}, f"exit status {completed.returncode}", seconds
+        for line in completed.stderr.splitlines():
+            logger.debug(f"{name}: {line}")
+        with open(result_path, 'r') as file:
+            return json.load(file), None, seconds
+
+def install_requirements(source_dir, state):
+    # Check if requirements.txt exists in source_dir
+    requirements_path = os.path.join(source_dir, 'requirements.txt')
+    if not os.path.exists(requirements_path):
+        return
+    with open(requirements_path, 'rb') as file:
+        requirements_hash = hashlib.sha256(file.read()).hexdigest()
+    if state.get('requirements') == requirements_hash:
+        return
+
+    logger.info("Found new requirements.txt. Installing packages...")
+    try:
+        subprocess.run([sys.executable, '-m', 'pip', 'install', '-r', requirements_path], check=True)
+        state['requirements'] = requirements_hash
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Failed to install packages from requirements.txt: {e}")
+
+def read_declarations(script_text):
+    options = {}
+    for declaration in DECLARATION_PATTERN.findall(script_text):
+        for option in declaration.split():
+            if '=' in option:
+                key, value = option.split('=', 1)
+                options[key.strip()] = value.strip()
+    return options
+
+def load_state(state_path):
+    if os.path.exists(state_path):
+        try:
+            with open(state_path, 'r') as file:
+                state = json.load(file)
+            state.setdefault('scripts', {})
+            return state
+        except (OSError, ValueError):
+            pass
+    return {'scripts': {}}
+
+def save_state(state_path, state):
+    os.makedirs(os.path.dirname(state_path), exist_ok=True)
+    with open(state_path, 'w') as file:
+        json.dump(state, file)
+
+class PreviousVariables:
+    """The variables file as the last build left it, read only if a script needs its old values."""
+
+    def __init__(self, store):
+        self.store = store
+        # With PreservePriorVariables the store already holds them
+        self._variables = dict(store.variables) if store.variables else None
+
+    @property
+    def variables(self):
+        if self._variables is None:
+            if os.path.exists(self.store.path):
+                with open(self.store.path, 'r') as file:
+                    self._variables = json.load(file)
+            else:
+                self._variables = {}
+        return self._variables
+
+    def age(self, names, now):
+        """Seconds since the oldest of these variables was reported, or None if one is missing."""
+        if not names:
+            return None
+        try:
+            oldest = min(datetime.fromisoformat(self.variables[name]['datetime']) for name in names)
+        except (KeyError, ValueError):
+            return None
+        return (now - oldest).total_seconds()
+
+    def restore(self, names):
+        restored = [name for name in names if name in self.variables]
+        for name in restored:
+            self.store.variables[name] = self.variables[name]
+        return restored
+
+def main():
+    # Child process side of run_script: run one script and write what it reported as JSON
+    file_path, result_path = sys.argv[1], sys.argv[2]
+    reported = {}
+
+    def sonne_var(key, value):
+        reported[key] = {
+            "data": value,
+            "datetime": str(datetime.now())
+        }
+        # Read back by run_script, which logs it
+        print(f"Reported variable {key} with {value}")
+
+    spec = importlib.util.spec_from_file_location("module.name", file_path)
+    module = importlib.util.module_from_spec(spec)
+    module.__dict__['sonne_var'] = sonne_var
+    spec.loader.exec_module(module)
+
+    with open(result_path, 'w') as file:
+        json.dump(reported, file)
+
+if __name__ == '__main__':
+    main()
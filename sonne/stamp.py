@@ -0,0 +1,94 @@
+# stamp.py
+
+import os
+import json
+import time
+from datetime import datetime
+from sonne.manifest import MANIFEST_FILENAME, PRIVATE_PREFIX
+
+STAMP_FILENAME = 'build_stamp.json'
+STAMP_VERSION = 1
+
+# Kept to os, json and the like: `sonne` checks the stamp before it loads the rest of itself
+
+def stamp_path(base_dir, config):
+    return os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'), STAMP_FILENAME)
+
+def input_snapshot(base_dir, config):
+    """Path -> [size, mtime] of every file a build reads: everything in the site directory, and Sonne's own code.
+
+    Only stats files, never reads them. The output and cache directories,
+    the variables file and the history database are left out, since the
+    build writes those itself.
+    """
+    base_dir = os.path.normpath(base_dir)
+    skipped = {os.path.normpath(os.path.join(base_dir, config.get_setting('DEFAULT', name)))
+               for name in ('OutputDirectory', 'CacheDirectory', 'VariablesFile')}
+    history_path = os.path.normpath(os.path.join(base_dir, config.get_setting('DEFAULT', 'HistoryFile')))
+    snapshot = {}
+    pending = [base_dir]
+    while pending:
+        with os.scandir(pending.pop()) as entries:
+            for entry in entries:
+                if (entry.name.startswith(PRIVATE_PREFIX) or entry.name == '__pycache__' or entry.path in skipped
+                        or entry.path.startswith(history_path)):
+                    continue
+                if entry.is_dir():
+                    pending.append(entry.path)
+                else:
+                    stat = entry.stat()
+                    snapshot[os.path.relpath(entry.path, base_dir)] = [stat.st_size, stat.st_mtime_ns]
+    # An upgraded Sonne may build differently
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in os.listdir(package_dir):
+        if name.endswith('.py'):
+            stat = os.stat(os.path.join(package_dir, name))
+            snapshot['sonne:' + name] = [stat.st_size, stat.st_mtime_ns]
+    return snapshot
+
+def output_state(base_dir, config):
+    # What builds leave behind; a refresh, a merge or a deleted output directory changes one of these
+    paths = [os.path.join(base_dir, config.get_setting('DEFAULT', 'VariablesFile')),
+             os.path.join(base_dir, config.get_setting('DEFAULT', 'OutputDirectory'), MANIFEST_FILENAME)]
+    state = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            state.append(None)
+            continue
+        state.append([stat.st_size, stat.st_mtime_ns])
+    return state
+
+def clear_stamp(base_dir, config):
+    # A build that stops half way must not leave the previous stamp vouching for the output
+    try:
+        os.remove(stamp_path(base_dir, config))
+    except FileNotFoundError:
+        pass
+
+def write_stamp(base_dir, config, snapshot, due=None):
+    """Record that the output is up to date with snapshot (taken when the build started) until due, if given."""
+    # Posts show the current year, so a new year needs a build too
+    new_year = datetime(datetime.now().year + 1, 1, 1).timestamp()
+    stamp = {
+        'version': STAMP_VERSION,
+        'inputs': snapshot,
+        'outputs': output_state(base_dir, config),
+        'due': min(due, new_year) if due is not None else new_year,
+    }
+    from sonne.postprocess import write_if_changed  # Only after a build, when it is loaded anyway
+    path = stamp_path(base_dir, config)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_if_changed(path, json.dumps(stamp).encode('utf-8'))
+
+def up_to_date(base_dir, config):
+    """Whether a build would change nothing: no input changed, nothing else wrote the output and no source script is due."""
+    try:
+        with open(stamp_path(base_dir, config), 'r') as file:
+            stamp = json.load(file)
+    except (OSError, ValueError):
+        return False
+    if stamp.get('version') != STAMP_VERSION or time.time() >= stamp['due']:
+        return False
+    return stamp['outputs'] == output_state(base_dir, config) and stamp['inputs'] == input_snapshot(base_dir, config)
@@ -0,0 +1,57 @@
+# stats.py
+
+import time
+from contextlib import contextmanager
+
+class BuildStats:
+    """Where a build spent its time, and how many outputs it wrote.
+
+    Stages are timed exclusively: a stage running inside another (images
+    inside blogs) is taken out of the outer one, so stage times add up to
+    the total. Individual files, source scripts, embedded blocks and images
+    are timed as well, for finding the slowest ones.
+    """
+
+    def __init__(self):
+        self.stages = {}   # stage name -> seconds, in the order the stages ran
+        self.timings = {}  # kind ('file', 'script', 'block', 'image') -> name -> [seconds, count]
+        self.files_written = 0
+        self.total = 0.0
+        self._started = time.perf_counter()
+        self._nested = []  # time spent in stages nested in each running stage
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed - self._nested.pop()
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def record(self, kind, name, seconds, count=1):
+        entry = self.timings.setdefault(kind, {}).setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += count
+
+    def merge(self, kind, timings):
+        # timings as kept by BlockEngine and ImagePipeline: name -> [seconds, count]
+        for name, (seconds, count) in timings.items():
+            self.record(kind, name, seconds, count)
+
+    def slowest(self, kind, count=10):
+        entries = sorted(self.timings.get(kind, {}).items(), key=lambda item: item[1][0], reverse=True)
+        return [{'name': name, 'seconds': seconds, 'count': runs} for name, (seconds, runs) in entries[:count]]
+
+    def finish(self):
+        self.total = time.perf_counter() - self._started
+
+    def to_dict(self, slowest=0):
+        """Totals and stage times, plus the `slowest` slowest items of every kind when asked for."""
+        result = {'total': self.total, 'stages': dict(self.stages), 'files_written': self.files_written}
+        if slowest:
+            result['slowest'] = {kind: self.slowest(kind, slowest) for kind in self.timings}
+        return result
@@ -0,0 +1,45 @@
+# templates.py
+
+from sonne.variable_manager import TOKEN_PATTERN
+
+def compile_template(text):
+    """Split template text into ('text', literal) segments and placeholder slots.
+
+    Slots are ('python', code), ('variable', name) or ('mond', name) and are
+    filled in by render_template, so a template is scanned once per build
+    instead of once per post and variable.
+    """
+    segments = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        if match.start() > position:
+            segments.append(('text', text[position:match.start()]))
+        python_code, var_name, mond_name = match.groups()
+        if python_code is not None:
+            segments.append(('python', python_code))
+        elif var_name is not None:
+            segments.append(('variable', var_name))
+        else:
+            segments.append(('mond', mond_name))
+        position = match.end()
+    if position < len(text):
+        segments.append(('text', text[position:]))
+    return segments
+
+def render_template(segments, store, mond_variables, used=None):
+    if store.blocks.workers:
+        store.prefetch_blocks([value for kind, value in segments if kind == 'python'])
+    return ''.join(value if kind == 'text' else store.resolve(kind, value, mond_variables, used)
+                   for kind, value in segments)
+
+class TemplateCache:
+    """Compiled templates keyed by the hash of their file, shared by every template a build uses."""
+
+    def __init__(self):
+        self.compiled = {}
+
+    def get(self, path, file_hash):
+        if file_hash not in self.compiled:
+            with open(path, 'r', encoding='utf-8') as file:
+                self.compiled[file_hash] = compile_template(file.read())
+        return self.compiled[file_hash]
@@ -1,45 +1,19 @@
 import os
 import re
-import importlib.util
 import json
+import logging
 from datetime import datetime
-import subprocess  # Added import for subprocess
-import sys         # Added import for sys to get the Python executable path
+from sonne.manifest import hash_variables
+from sonne.embedded import BlockEngine, VOLATILE
+from sonne.sources import run_sources
 
 sonne_variables = {};
 
-def execute_scripts(source_dir):
-    # Check if requirements.txt exists in source_dir
-    requirements_path = os.path.join(source_dir, 'requirements.txt')
-    if os.path.exists(requirements_path):
-        print("Found requirements.txt. Installing packages...")
-        try:
-            subprocess.run([sys.executable, '-m', 'pip', 'install', '-r', requirements_path], check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"Failed to install packages from requirements.txt: {e}")
-            # Optionally, you can exit the script or handle the error as needed
-            # sys.exit(1)
-    else:
-        print("No requirements.txt found in the source directory.")
-        
-    for filename in os.listdir(source_dir):
-        if filename.endswith('.py') and not filename.startswith('__'):
-            file_path = os.path.join(source_dir, filename)
-            spec = importlib.util.spec_from_file_location("module.name", file_path)
-            module = importlib.util.module_from_spec(spec)
-
-            module.__dict__['sonne_var'] = report_variable_init
-
-            spec.loader.exec_module(module)
-            print(f"Ran {filename}")
-
-def report_variable_init(key, value):
-    global sonne_variables
-    sonne_variables[key] = {
-        "data": value,
-        "datetime": str(datetime.now())
-    }
-    print(f"Reported variable {key} with {value}")
+logger = logging.getLogger(__name__)
+
+# One scanner for every placeholder kind: {p}{#code#}, {+}{variable} and {-}{mond_variable}
+TOKEN_PATTERN = re.compile(r'\{p\}\{#([\s\S]*?)#\}|\{\+\}\{(.*?)\}|\{-\}\{(.*?)\}')
+VARIABLE_PATTERN = re.compile(r'\{\+\}\{(.*?)\}')
 
 def report_variable(key, value, variables_path):
     """Update or add a variable in the global sonne_variables dictionary and save to file."""
@@ -53,24 +27,25 @@ def report_variable(key, value, variables_path):
         "data": value,
         "datetime": str(datetime.now())
     }
-    print(f"Reported late variable {key} with value updated at {sonne_variables[key]['datetime']}")
+    logger.debug(f"Reported late variable {key} with value updated at {sonne_variables[key]['datetime']}")
 
     # Save the updated variables back to the file
     save_variables(sonne_variables, variables_path)
 
-def process_variables(base_dir, config):
-    global sonne_variables
-    variables_path = os.path.join(base_dir, config.get_setting('DEFAULT', 'VariablesFile'))
-    sonne_variables = load_variables(variables_path) \
-            if config.get_setting('DEFAULT', 'PreservePriorVariables') else {}
+def process_variables(base_dir, config, store, jobs=1, stats=None):
+    if config.get_setting('DEFAULT', 'PreservePriorVariables'):
+        store.load()
     source_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'SourceDirectory'))
-    execute_scripts(source_dir)
-    save_variables(sonne_variables, variables_path)
+    cache_dir = os.path.join(base_dir, config.get_setting('DEFAULT', 'CacheDirectory'))
+    due = run_sources(source_dir, config, store, cache_dir, jobs, stats)
+    if store.history is not None:
+        store.history.prune()
+    return due
 
 def save_variables(data, filepath):
-    print(f'\n\n\n{data}\n\n\n')
     with open(filepath, 'w') as file:
         json.dump(data, file)
+    logger.info(f"Saved {len(data)} variables to {filepath}")
 
 def load_variables(filepath):
     if not os.path.exists(filepath):
@@ -95,37 +70,142 @@ def get_variable_data(data_name, data):
     return str(data[data_name]["data"])
 
 def substitute_variables(content, filepath):
-    data = load_variables(filepath)
-
-    def replace_sonne_variable(match):
-        var_name = match.group(1)
-        try:
-            return get_variable_data(var_name, data)
-        except KeyError:
-            print(f"Variable {var_name} not found.")
-            return f"{{x}}{{{var_name}}}"
-        
-    def execute_embedded_python(match):
-        python_code = match.group(1).strip()  # Clean and prepare the code for execution
-
-        print(f'----EXECUTION BLOCK-----\n\n{python_code}\n\n----/EXECUTION BLOCK----')
-
-        # Prepare code for execution to properly capture the output without using 'return'
-        complete_code = f'result = None\n{python_code}\n'  # Assuming the code modifies 'result'
-
+    return VariableStore(filepath).load().substitute(content)
+
+class VariableStore:
+    """The Sonne variables of one build.
+
+    Loaded once by generate_site, shared by every stage, and written back to
+    the variables file once by flush() at the end of the build.
+    """
+
+    def __init__(self, path, blocks=None, content=None, history=None):
+        self.path = path
+        self.blocks = blocks if blocks is not None else BlockEngine()
+        self.content = content  # ContentStore holding the bodies of blog posts
+        self.history = history  # VariableHistory, when VariableHistory is on
+        self.variables = {}
+        self.dirty = False
+        self._hashes = None
+        self._saved = None  # (size and mtime of the variables file, its variables) as last read or written
+        self.build_id = os.urandom(8).hex()  # What volatile blocks depend on, new every build
+
+    def reset(self):
+        # Start the next build of a long-running `sonne serve` from no variables, like a fresh process
+        self.variables = {}
+        self.dirty = False
+        self._hashes = None
+        self.build_id = os.urandom(8).hex()
+
+    def load(self):
+        self.variables = dict(self.saved())
+        self._hashes = None
+        return self
+
+    def saved(self):
+        """The variables as the file on disk holds them, read again only when something else wrote it."""
+        file_state = self._file_state()
+        if self._saved is None or self._saved[0] != file_state:
+            self._saved = (file_state, load_variables(self.path) if file_state is not None else {})
+        return self._saved[1]
+
+    def report(self, key, value):
+        # A value that did not change keeps its datetime, so the variables file is left alone
+        previous = self.variables.get(key) or self.saved().get(key)
+        unchanged = previous is not None and previous.get("data") == value
+        self.variables[key] = {
+            "data": value,
+            "datetime": previous["datetime"] if unchanged else str(datetime.now())
+        }
+        self.mark_changed()
+        logger.debug(f"Reported late variable {key} with value updated at {self.variables[key]['datetime']}")
+
+    def get(self, name):
+        if name not in self.variables:
+            return None
+        return self.variables[name]["data"]
+
+    def mark_changed(self):
+        self.dirty = True
+        self._hashes = None
+
+    def hashes(self):
+        if self._hashes is None:
+            self._hashes = hash_variables(self.variables, self.history.hashes() if self.history is not None else None)
+            # Not part of '*', or every output reading all variables would be rebuilt each time
+            self._hashes[VOLATILE] = self.build_id
+        return self._hashes
+
+    def flush(self):
+        # Written only when the variables differ from the file, so its mtime says when a value last changed
+        if self.dirty and self.variables != self.saved():
+            save_variables(self.variables, self.path)
+            self._saved = (self._file_state(), dict(self.variables))
+        self.dirty = False
+
+    def _file_state(self):
         try:
-            # Create a local scope, including the data dictionary
-            local_scope = {'data': data}
-            exec(complete_code, {}, local_scope)  # Execute the prepared code in the local scope
-            # Retrieve the 'result' variable set by the executed code
-            return str(local_scope['result']) if 'result' in local_scope else ''
-        except Exception as e:
-            print(f"Error executing embedded Python: {e}")
-            return "Error in Python Code"
-
-    # First replace Python code blocks
-    content = re.sub(r'\{p\}\{#([\s\S]*?)#\}', execute_embedded_python, content)
-    # Then replace variable placeholders
-    updated_content = re.sub(r'\{\+\}\{(.*?)\}', replace_sonne_variable, content)
-
-    return updated_content
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def substitute(self, content, mond_variables=None, used=None):
+        """Replace every placeholder in content in a single pass.
+
+        Mond placeholders are only replaced when mond_variables is given. The
+        names of the Sonne variables read (including those embedded Python
+        reads, or '*' when a block may read any of them) are added to used.
+        """
+        if self.blocks.workers:
+            self.prefetch_blocks([match.group(1) for match in TOKEN_PATTERN.finditer(content) if match.group(1) is not None])
+
+        def replace(match):
+            python_code, var_name, mond_name = match.groups()
+            if python_code is not None:
+                return self.resolve('python', python_code, mond_variables, used)
+            if var_name is not None:
+                return self.resolve('variable', var_name, mond_variables, used)
+            return self.resolve('mond', mond_name, mond_variables, used)
+
+        return TOKEN_PATTERN.sub(replace, content)
+
+    def resolve(self, kind, value, mond_variables=None, used=None):
+        """Text for one placeholder: 'python' code, a Sonne 'variable' or a 'mond' variable."""
+        if kind == 'python':
+            if used is not None:
+                used.update(self.blocks.block_dependencies(value.strip()))
+            # Embedded Python may print variable placeholders of its own
+            return VARIABLE_PATTERN.sub(lambda match: self.resolve('variable', match.group(1), used=used),
+                                        self.execute_embedded_python(value))
+        if kind == 'variable':
+            if '@' in value:
+                # {+}{name@hour}: a rolled up series from the variable history
+                if used is not None:
+                    used.add(value.partition('@')[0] + '@history')
+                if self.history is None:
+                    return ''
+                try:
+                    return self.history.render(value)
+                except ValueError as e:
+                    logger.warning(f"Cannot fill in {{+}}{{{value}}}: {e}")
+                    return ''
+            if used is not None:
+                used.add(value)
+            return get_variable_data(value, self.variables) or ''
+        if mond_variables is None:
+            return f"{{-}}{{{value}}}"
+        if value not in mond_variables:
+            return ''
+        # Mond values such as the post content carry Sonne placeholders too
+        return self.substitute(str(mond_variables[value]), used=used)
+
+    def execute_embedded_python(self, python_code):
+        # Clean and prepare the code, then run it (or reuse its output) through the block engine
+        return self.blocks.run(python_code.strip(), self.variables, self.hashes())
+
+    def prefetch_blocks(self, python_codes):
+        """Run all of a page's blocks up front, so a block worker pool can run them concurrently."""
+        python_codes = [code.strip() for code in python_codes]
+        if python_codes:
+            self.blocks.run_many(python_codes, self.variables, self.hashes())
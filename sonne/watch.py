@@ -0,0 +1,146 @@
+# watch.py
+
+import os
+import struct
+import ctypes
+import ctypes.util
+import logging
+
+logger = logging.getLogger(__name__)
+
+# inotify event bits, from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, length of the name that follows
+
+# Editors and Python leave these around; none of them are site content
+IGNORED_NAMES = ('__pycache__',)
+IGNORED_SUFFIXES = ('.tmp', '.swp', '.swx', '~')
+
+class InotifyWatcher:
+    """Reports changed files under a directory tree through Linux inotify, called through ctypes.
+
+    fileno() can be passed to select(); changes() returns the paths that
+    changed since it was last called, without blocking.
+    """
+
+    def __init__(self, root, ignore=None):
+        self.root = root
+        self.ignore = ignore or (lambda path: False)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._watches = {}  # watch descriptor -> directory
+        self._add_tree(root)
+
+    def fileno(self):
+        return self._fd
+
+    def changes(self):
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; anything may have changed
+                    changed.add(self.root)
+                    continue
+                if mask & IN_IGNORED:
+                    self._watches.pop(wd, None)
+                    continue
+                directory = self._watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, os.fsdecode(name)) if name else directory
+                if self.ignore(path):
+                    continue
+                if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+                changed.add(path)
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _add_tree(self, top):
+        for root, dirs, files in os.walk(top):
+            dirs[:] = [d for d in dirs if not self.ignore(os.path.join(root, d))]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {root}')
+            self._watches[wd] = root
+
+class PollingWatcher:
+    """Finds changed files by comparing the size and mtime of every file between calls.
+
+    For systems without inotify; fileno() is None, so the caller polls changes() on a timer.
+    """
+
+    def __init__(self, root, ignore=None):
+        self.root = root
+        self.ignore = ignore or (lambda path: False)
+        self._snapshot = self._scan()
+
+    def fileno(self):
+        return None
+
+    def changes(self):
+        snapshot = self._scan()
+        changed = {path for path in snapshot.keys() | self._snapshot.keys()
+                   if snapshot.get(path) != self._snapshot.get(path)}
+        self._snapshot = snapshot
+        return changed
+
+    def close(self):
+        pass
+
+    def _scan(self):
+        snapshot = {}
+        for root, dirs, files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if not self.ignore(os.path.join(root, d))]
+            for file in files:
+                path = os.path.join(root, file)
+                if self.ignore(path):
+                    continue
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue  # Deleted while we looked
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+def create_watcher(root, ignore=None, polling=False):
+    """An InotifyWatcher for root, or a PollingWatcher where inotify is unavailable (or polling is asked for)."""
+    if not polling:
+        try:
+            return InotifyWatcher(root, ignore)
+        except (OSError, AttributeError) as e:
+            # AttributeError: a libc without inotify, such as on macOS
+            logger.warning(f"inotify is unavailable ({e}), polling for changes instead")
+    return PollingWatcher(root, ignore)
+
+def ignored_path(path, excluded):
+    """Whether a changed path is not site content: build outputs and caches (excluded), dotfiles and editor leftovers."""
+    if any(path == directory or path.startswith(directory + os.sep) for directory in excluded):
+        return True
+    name = os.path.basename(path)
+    return name.startswith('.') or name in IGNORED_NAMES or name.endswith(IGNORED_SUFFIXES)
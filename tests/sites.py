@@ -0,0 +1,78 @@
+# sites.py
+
+# A small site with every kind of input, for tests that build it
+import os
+import filecmp
+from sonne.setup import setup
+
+POST_COUNT = 12
+PAGE_COUNT = 4
+
+def make_site(site):
+    config = setup(site)
+    config.set_setting('DEFAULT', 'SearchIndex', True)
+    blog_dir = os.path.join(site, 'blog')
+    with open(os.path.join(blog_dir, 'blog_base.html'), 'w') as file:
+        file.write("<html><head><title>{-}{title}</title></head>\n"
+                   "<body><h1>{-}{title}</h1><p>Battery: {+}{battery_level}</p>\n{-}{content}\n"
+                   "<a href=\"{-}{prev_post}\">prev</a> <a href=\"{-}{next_post}\">next</a>\n"
+                   "<footer>{p}{#\nresult = len(data['all_blog_posts']['data'])\n#} posts</footer></body></html>\n")
+    with open(os.path.join(blog_dir, 'archive_base.html'), 'w') as file:
+        file.write("<html><body><h1>{-}{archive_title}</h1>{-}{post_list}{-}{pagination}</body></html>\n")
+
+    images = write_images(os.path.join(blog_dir, 'imgs'))
+    for number in range(POST_COUNT):
+        image = f"\n![picture {number}](imgs/{images[number % len(images)]})\n" if images else ''
+        with open(os.path.join(blog_dir, f'post{number}.md'), 'w') as file:
+            file.write(f"---\ntitle: Post {number}\ndate_posted: 2024-{number % 12 + 1:02d}-01\n"
+                       f"page_url: post-{number}\ntags: [solar, tag{number % 3}]\ncategory: notes\n---\n"
+                       f"# Post {number}\n\nSome words about panels and batteries, number {number}.\n{image}")
+
+    pages_dir = os.path.join(site, 'pages')
+    for number in range(PAGE_COUNT):
+        write_page(site, f'page{number}.html', f"<html><body>Page {number}, battery {{+}}{{battery_level}}</body></html>\n")
+    write_page(site, 'about.html', "<html><body>About this site, no variables here.</body></html>\n")
+    write_page(site, 'style.css', "body { color : black ; }\n")
+    with open(os.path.join(site, 'index.html'), 'w') as file:
+        file.write("<html><body>{p}{#\nresult = ', '.join(p['title'] for p in data['all_blog_posts']['data'])\n#}"
+                   "</body></html>\n")
+    set_battery(site, 87)
+
+def write_page(site, name, text):
+    with open(os.path.join(site, 'pages', name), 'w') as file:
+        file.write(text)
+
+def set_battery(site, level):
+    with open(os.path.join(site, 'sonne_sources', 'battery.py'), 'w') as file:
+        file.write(f"sonne_var('battery_level', {level})\n")
+
+def write_images(directory):
+    # Posts get images only where Pillow is installed
+    try:
+        from PIL import Image
+    except ImportError:
+        return []
+    os.makedirs(directory)
+    names = []
+    for number, color in enumerate(((200, 40, 40), (40, 200, 40), (40, 40, 200))):
+        name = f'image{number}.png'
+        Image.new('RGB', (640, 400), color).save(os.path.join(directory, name))
+        names.append(name)
+    return names
+
+def rendered(stats):
+    # Outputs a build rendered rather than skipped as unchanged, relative to the output directory
+    return set(stats.timings.get('file', {}))
+
+def output_tree(output_dir):
+    # Relative path of every output file, without Sonne's own bookkeeping
+    return sorted(os.path.relpath(os.path.join(root, name), output_dir)
+                  for root, dirs, files in os.walk(output_dir)
+                  for name in files if not name.startswith('.sonne'))
+
+def assert_same_output(output_dir, other_dir):
+    files = output_tree(output_dir)
+    assert files == output_tree(other_dir)
+    matched, mismatched, errors = filecmp.cmpfiles(output_dir, other_dir, files, shallow=False)
+    assert mismatched == [] and errors == []
+    return files
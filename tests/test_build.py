@@ -0,0 +1,64 @@
+# test_build.py
+
+import os
+from sonne.generator import generate_site
+from sites import make_site, write_page, set_battery, rendered, output_tree
+
+def output_mtimes(output_dir):
+    return {path: os.stat(os.path.join(output_dir, path)).st_mtime_ns for path in output_tree(output_dir)}
+
+def test_second_build_leaves_outputs_alone(tmp_path):
+    site = str(tmp_path)
+    make_site(site)
+    output_dir = os.path.join(site, 'output')
+    first = rendered(generate_site(site, jobs=1))
+    assert os.path.join('pages', 'page0.html') in first
+    before = output_mtimes(output_dir)
+
+    assert rendered(generate_site(site, jobs=1)) == set()
+    assert output_mtimes(output_dir) == before
+
+def test_edits_rebuild_only_their_dependents(tmp_path):
+    site = str(tmp_path)
+    make_site(site)
+    generate_site(site, jobs=1)
+
+    write_page(site, 'page1.html', "<html><body>Page one, rewritten, battery {+}{battery_level}</body></html>\n")
+    assert rendered(generate_site(site, jobs=1)) == {os.path.join('pages', 'page1.html')}
+
+    # Every page and post reads battery_level, except about.html
+    set_battery(site, 42)
+    stats = generate_site(site, jobs=1)
+    assert os.path.join('pages', 'page2.html') in rendered(stats)
+    assert os.path.join('blog', '2024-01-01-post-0.html') in rendered(stats)
+    assert os.path.join('pages', 'about.html') not in rendered(stats)
+    assert os.path.join('index.html') not in rendered(stats)
+    with open(os.path.join(site, 'output', 'pages', 'page2.html')) as file:
+        assert 'battery 42' in file.read()
+
+def test_deleted_inputs_are_pruned(tmp_path):
+    site = str(tmp_path)
+    make_site(site)
+    output_dir = os.path.join(site, 'output')
+    generate_site(site, jobs=1)
+    assert os.path.exists(os.path.join(output_dir, 'blog', '2024-04-01-post-3.html'))
+
+    os.remove(os.path.join(site, 'pages', 'page3.html'))
+    os.remove(os.path.join(site, 'blog', 'post3.md'))
+    generate_site(site, jobs=1)
+    files = output_tree(output_dir)
+    assert not any(path.startswith(os.path.join('pages', 'page3.html')) for path in files)
+    assert not any(path.startswith(os.path.join('blog', '2024-04-01-post-3.html')) for path in files)
+    assert os.path.join('pages', 'page2.html') in files
+
+def test_dotfiles_are_passed_through(tmp_path):
+    site = str(tmp_path)
+    make_site(site)
+    os.makedirs(os.path.join(site, '.well-known'))
+    with open(os.path.join(site, '.well-known', 'security.txt'), 'w') as file:
+        file.write("Contact: mailto:sonne@example.com\n")
+    with open(os.path.join(site, '.htaccess'), 'w') as file:
+        file.write("Options -Indexes\n")
+    generate_site(site, jobs=1)
+    files = output_tree(os.path.join(site, 'output'))
+    assert '.htaccess' in files and os.path.join('.well-known', 'security.txt') in files
@@ -0,0 +1,58 @@
+# test_embedded.py
+
+import time
+from sonne.manifest import hash_variables
+from sonne.embedded import BlockEngine, find_data_references, block_label, ERROR_OUTPUT, VOLATILE
+
+def variables(**values):
+    return {name: {'data': value, 'datetime': '2024-01-01 00:00:00'} for name, value in values.items()}
+
+def runs(engine, code):
+    return engine.timings.get(block_label(code), [0.0, 0])[1]
+
+def test_block_runs_again_only_when_its_variables_change():
+    engine = BlockEngine()
+    code = "result = data['battery_level']['data'] * 2"
+    first = variables(battery_level=40, temperature=20)
+    assert engine.run(code, first, hash_variables(first)) == '80'
+
+    other = variables(battery_level=40, temperature=25)
+    assert engine.run(code, other, hash_variables(other)) == '80'
+    assert runs(engine, code) == 1
+
+    changed = variables(battery_level=45, temperature=25)
+    assert engine.run(code, changed, hash_variables(changed)) == '90'
+    assert runs(engine, code) == 2
+
+def test_data_references():
+    assert find_data_references("result = data['a']['data'] + data.get('b')['data']") == {'a', 'b'}
+    assert find_data_references("result = history('power', 'day')") == {'power@history'}
+    assert find_data_references("result = len(data)") == {'*'}
+    assert find_data_references("key = 'a'\nresult = data[key]") == {'*'}
+    assert find_data_references("import datetime\nresult = datetime.datetime.now()") == set()
+    assert find_data_references("# sonne: volatile\nimport time\nresult = time.time()") == {VOLATILE}
+
+def test_volatile_block_runs_every_build():
+    engine = BlockEngine()
+    code = "# sonne: volatile\nimport time\nresult = time.time_ns()"
+    values = variables(battery_level=40)
+    for build_id in ('first', 'second'):
+        engine.run(code, values, dict(hash_variables(values), **{VOLATILE: build_id}))
+    assert runs(engine, code) == 2
+
+def test_slow_block_times_out_in_process():
+    engine = BlockEngine(workers=0, timeout=0.5)
+    start = time.perf_counter()
+    assert engine.run("import time\ntime.sleep(30)", {}, hash_variables({})) == ERROR_OUTPUT
+    assert engine.run("while True:\n    pass", {}, hash_variables({})) == ERROR_OUTPUT
+    assert time.perf_counter() - start < 10
+
+def test_slow_block_times_out_in_pool():
+    engine = BlockEngine(workers=2, timeout=0.5)
+    try:
+        start = time.perf_counter()
+        outputs = engine.run_many(["import time\ntime.sleep(30)", "result = 'quick'"], {}, hash_variables({}))
+        assert outputs == [ERROR_OUTPUT, 'quick']
+        assert time.perf_counter() - start < 10
+    finally:
+        engine.close()
@@ -0,0 +1,16 @@
+# test_parallel.py
+
+import os
+import shutil
+from sonne.generator import generate_site
+from sites import make_site, assert_same_output
+
+def test_parallel_build_matches_serial_build(tmp_path):
+    serial = str(tmp_path / 'serial')
+    make_site(serial)
+    parallel = str(tmp_path / 'parallel')
+    shutil.copytree(serial, parallel)
+
+    generate_site(serial, jobs=1)
+    generate_site(parallel, jobs=4)
+    assert_same_output(os.path.join(serial, 'output'), os.path.join(parallel, 'output'))
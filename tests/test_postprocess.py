@@ -0,0 +1,38 @@
+# test_postprocess.py
+
+import os
+import gzip
+from sonne.postprocess import precompress_outputs
+
+def write_output(path, text, mtime=None):
+    # Swapped in like copy_file does, keeping a given mtime like a hardlink or copystat
+    with open(path + '.new', 'w') as file:
+        file.write(text)
+    if mtime is not None:
+        os.utime(path + '.new', (mtime, mtime))
+    os.replace(path + '.new', path)
+
+def test_siblings_follow_output_with_older_mtime(tmp_path):
+    output_dir = str(tmp_path)
+    path = os.path.join(output_dir, 'data.json')
+    write_output(path, '{"readings": [' + ', '.join(['1'] * 200) + ']}')
+    precompress_outputs(output_dir)
+
+    # Restored with cp -p, rsync -a or tar: new bytes, an mtime far older than the .gz
+    new_text = '{"readings": [' + ', '.join(['2'] * 200) + ']}'
+    write_output(path, new_text, mtime=978307200)
+    precompress_outputs(output_dir)
+    with open(path + '.gz', 'rb') as file:
+        assert gzip.decompress(file.read()).decode('utf-8') == new_text
+
+def test_unchanged_outputs_keep_their_siblings(tmp_path):
+    output_dir = str(tmp_path)
+    path = os.path.join(output_dir, 'page.html')
+    write_output(path, '<p>' + 'sunshine ' * 100 + '</p>')
+    precompress_outputs(output_dir)
+    # A marker in place of the sibling shows whether it was compressed again
+    with open(path + '.gz', 'wb') as file:
+        file.write(b'untouched')
+    precompress_outputs(output_dir)
+    with open(path + '.gz', 'rb') as file:
+        assert file.read() == b'untouched'
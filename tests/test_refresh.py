@@ -0,0 +1,25 @@
+# test_refresh.py
+
+import os
+from sonne.generator import generate_site, refresh_site
+from sites import make_site, set_battery, rendered, output_tree, POST_COUNT, PAGE_COUNT
+
+def test_refresh_renders_only_outputs_of_changed_variables(tmp_path):
+    site = str(tmp_path)
+    make_site(site)
+    generate_site(site, jobs=1)
+    output_dir = os.path.join(site, 'output')
+    posts = {path for path in output_tree(output_dir)
+             if path.startswith(os.path.join('blog', '2024-')) and path.endswith('.html')}
+    assert len(posts) == POST_COUNT
+
+    # Nothing changed: nothing to render
+    assert rendered(refresh_site(site)) == set()
+
+    # Pages and posts show battery_level; about.html, index.html and the archives do not
+    set_battery(site, 12)
+    stats = refresh_site(site)
+    pages = {os.path.join('pages', f'page{number}.html') for number in range(PAGE_COUNT)}
+    assert rendered(stats) == pages | posts
+    with open(os.path.join(output_dir, 'pages', 'page0.html')) as file:
+        assert 'battery 12' in file.read()
@@ -0,0 +1,20 @@
+# test_shards.py
+
+import os
+import shutil
+from sonne.generator import generate_site, merge_site
+from sites import make_site, assert_same_output
+
+def test_merged_shards_match_full_build(tmp_path):
+    sharded = str(tmp_path / 'sharded')
+    make_site(sharded)
+    full = str(tmp_path / 'full')
+    shutil.copytree(sharded, full)
+
+    generate_site(full, jobs=1)
+    generate_site(sharded, jobs=1, shard=(1, 2))
+    generate_site(sharded, jobs=1, shard=(2, 2))
+    merge_site(sharded, jobs=1)
+
+    files = assert_same_output(os.path.join(full, 'output'), os.path.join(sharded, 'output'))
+    assert any(path.startswith(os.path.join('blog', 'tags')) for path in files)
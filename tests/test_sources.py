@@ -0,0 +1,77 @@
+# test_sources.py
+
+import os
+import textwrap
+from sonne.config import Config
+from sonne.variable_manager import VariableStore, process_variables
+
+def write_script(site, name, body):
+    source_dir = os.path.join(site, 'sonne_sources')
+    os.makedirs(source_dir, exist_ok=True)
+    with open(os.path.join(source_dir, name), 'w') as file:
+        file.write(textwrap.dedent(body))
+
+def run_build(site):
+    # The variables stage of a build: run the scripts, then write the variables file
+    config = Config(os.path.join(site, 'sonne.config'))
+    store = VariableStore(os.path.join(site, config.get_setting('DEFAULT', 'VariablesFile')))
+    process_variables(site, config, store)
+    store.flush()
+    return store
+
+def test_timed_out_script_keeps_previous_value(tmp_path):
+    site = str(tmp_path)
+    write_script(site, 'battery.py', """\
+        # sonne: timeout=2
+        sonne_var('battery_level', 71)
+    """)
+    assert run_build(site).get('battery_level') == 71
+
+    write_script(site, 'battery.py', """\
+        # sonne: timeout=0.5
+        import time
+        time.sleep(30)
+        sonne_var('battery_level', 12)
+    """)
+    assert run_build(site).get('battery_level') == 71
+
+def test_failing_script_keeps_stale_value(tmp_path):
+    site = str(tmp_path)
+    write_script(site, 'weather.py', "sonne_var('temperature', 21.5)\n")
+    first = run_build(site).variables['temperature']
+
+    write_script(site, 'weather.py', """\
+        import sys
+        sonne_var('temperature', -40)
+        sys.exit(3)
+    """)
+    store = run_build(site)
+    # The value and when it was reported, as the last successful run left them
+    assert store.variables['temperature'] == first
+
+def test_fresh_value_within_ttl_skips_script(tmp_path):
+    site = str(tmp_path)
+    runs_path = os.path.join(site, 'runs.txt')
+    write_script(site, 'inverter.py', f"""\
+        # sonne: ttl=300
+        with open({runs_path!r}, 'a') as file:
+            file.write('ran\\n')
+        sonne_var('inverter_watts', 250)
+    """)
+    run_build(site)
+    store = run_build(site)
+    assert store.get('inverter_watts') == 250
+    with open(runs_path) as file:
+        assert file.read().count('ran') == 1
+
+def test_skipped_scripts_leave_variables_file_alone(tmp_path):
+    site = str(tmp_path)
+    write_script(site, 'inverter.py', """\
+        # sonne: ttl=300
+        sonne_var('inverter_watts', 250)
+    """)
+    store = run_build(site)
+    before = os.stat(store.path).st_mtime_ns
+    os.utime(store.path, ns=(before - 10**9, before - 10**9))
+    run_build(site)
+    assert os.stat(store.path).st_mtime_ns == before - 10**9